@@ -8,15 +8,26 @@ import os
 import requests
 from dotenv import load_dotenv
 import json
+import re
+import time
 from datetime import datetime, timedelta
 import random
 
+from deadlines import upstream_timeout
+from mindbody_client import get_clients
+from quota import check_budget, count_call, set_caller
+
 load_dotenv()
 
 API_KEY = os.getenv("MINDBODY_API_KEY")
 SITE_ID = os.getenv("MINDBODY_SITE_ID")
 BASE_URL = os.getenv("MINDBODY_BASE_URL")
 
+# Local mirror of existing clients, reused between import runs
+CLIENT_MIRROR_FILE = os.path.join(os.getenv("MINDBODY_DATA_DIR", "data"), "clients_mirror.json")
+CLIENT_MIRROR_MAX_AGE_HOURS = float(os.getenv("CLIENT_MIRROR_MAX_AGE_HOURS", "24"))
+CLIENT_PAGE_SIZE = 200
+
 HEADERS = {
     "Api-Key": API_KEY,
     "SiteId": SITE_ID,
@@ -151,6 +162,205 @@ SAMPLE_CLIENTS = [
 ]
 
 
+# ============================================================================
+# EXISTING CLIENTS - ONE PAGED SCAN + LOCAL MIRROR
+# ============================================================================
+
+MIRROR_FIELDS = ("Id", "FirstName", "LastName", "Email", "MobilePhone", "BirthDate")
+
+
+def scan_existing_clients():
+    """
+    Fetch every existing client with one paged scan of /client/clients
+    (authenticated, budgeted and deadline-bound via mindbody_client)
+    """
+    clients, offset = [], 0
+    print(f"\n📥 Scanning existing clients...")
+
+    while True:
+        data = get_clients(None, CLIENT_PAGE_SIZE, offset)
+        if not isinstance(data, dict) or "Clients" not in data:
+            raise RuntimeError(f"Client scan failed: {str(data)[:200]}")
+
+        page = data.get("Clients") or []
+        clients.extend({field: c.get(field) for field in MIRROR_FIELDS} for c in page)
+        offset += len(page)
+
+        total = (data.get("PaginationResponse") or {}).get("TotalResults")
+        if len(page) < CLIENT_PAGE_SIZE or (total is not None and offset >= total):
+            break
+
+    print(f"   Found {len(clients)} existing clients")
+    save_client_mirror(clients)
+    return clients
+
+
+def find_client_by_email(email):
+    """
+    Existing client with exactly this email (one search call), or None
+    Raises RuntimeError if the search fails
+    """
+    data = get_clients(email, 10, 0)
+    if not isinstance(data, dict) or "Clients" not in data:
+        raise RuntimeError(f"Client search failed: {str(data)[:200]}")
+    for client in data["Clients"] or []:
+        if _norm_email(client.get("Email")) == _norm_email(email):
+            return {field: client.get(field) for field in MIRROR_FIELDS}
+    return None
+
+
+def lookup_clients_by_email(candidates):
+    """
+    Fallback when the full scan fails: search each candidate's email.
+    Rows whose search also fails are not deduped.
+    """
+    print(f"\n🔁 Falling back to per-email checks for {len(candidates)} rows...")
+    found = []
+    for client in candidates:
+        email = client.get("Email")
+        if not _norm_email(email):
+            continue
+        try:
+            match = find_client_by_email(email)
+        except Exception as e:
+            print(f"   ⚠️ Could not check {email}, not deduped: {e}")
+            continue
+        if match:
+            found.append(match)
+    return found
+
+
+def save_client_mirror(clients):
+    os.makedirs(os.path.dirname(CLIENT_MIRROR_FILE) or ".", exist_ok=True)
+    with open(CLIENT_MIRROR_FILE, "w", encoding="utf-8") as f:
+        json.dump({"saved_at": time.time(), "clients": clients}, f)
+
+
+def load_existing_clients(use_mirror=True, candidates=()):
+    """
+    Existing clients from the local mirror if it is fresh enough,
+    otherwise from a new scan (which refreshes the mirror).
+    If the scan fails, only the candidates' emails are looked up.
+
+    Returns (clients, complete): complete is False for the fallback,
+    whose result must not be saved as the mirror
+    """
+    if use_mirror and os.path.exists(CLIENT_MIRROR_FILE):
+        with open(CLIENT_MIRROR_FILE, encoding="utf-8") as f:
+            mirror = json.load(f)
+        age_hours = (time.time() - mirror.get("saved_at", 0)) / 3600
+        if age_hours <= CLIENT_MIRROR_MAX_AGE_HOURS:
+            print(f"\n📂 Using client mirror ({len(mirror['clients'])} clients, {age_hours:.1f}h old)")
+            return mirror["clients"], True
+    try:
+        return scan_existing_clients(), True
+    except Exception as e:
+        print(f"⚠️ {e}")
+        return lookup_clients_by_email(candidates), False
+
+
+# ============================================================================
+# DEDUP INDEX - CLASSIFY CANDIDATES AS NEW / EXISTING / CONFLICTING
+# ============================================================================
+
+def _norm_email(value):
+    return (value or "").strip().lower() or None
+
+
+def _norm_phone(value):
+    digits = re.sub(r"\D", "", value or "")
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+def _norm_name(client):
+    first = (client.get("FirstName") or "").strip().lower()
+    last = (client.get("LastName") or "").strip().lower()
+    if not first or not last:
+        return None
+    # Names alone collide too often; pair them with the birth date
+    return f"{first}|{last}|{str(client.get('BirthDate') or '')[:10]}"
+
+
+def build_client_index(clients):
+    """
+    Hash index of existing clients: email / phone / name+birthdate -> client ID
+    """
+    index = {"email": {}, "phone": {}, "name": {}}
+    for client in clients:
+        client_id = client.get("Id")
+        for kind, key in (
+            ("email", _norm_email(client.get("Email"))),
+            ("phone", _norm_phone(client.get("MobilePhone"))),
+            ("name", _norm_name(client)),
+        ):
+            if key:
+                index[kind].setdefault(key, client_id)
+    return index
+
+
+def classify_clients(candidates, index):
+    """
+    Single pass over candidate rows:
+    - existing: email matches an existing client and nothing points elsewhere
+    - conflicting: matches disagree (email vs phone/name point to different
+      clients, phone or name+birthdate match with a different email, or the
+      row repeats an earlier row in the same import)
+    - new: no match at all
+    """
+    result = {"new": [], "existing": [], "conflicting": []}
+    seen_in_batch = {"email": set(), "phone": set()}
+
+    for client in candidates:
+        keys = {
+            "email": _norm_email(client.get("Email")),
+            "phone": _norm_phone(client.get("MobilePhone")),
+            "name": _norm_name(client),
+        }
+        matches = {kind: index[kind].get(key) for kind, key in keys.items() if key and key in index[kind]}
+        reasons = []
+
+        for kind in ("email", "phone"):
+            if keys[kind] and keys[kind] in seen_in_batch[kind]:
+                reasons.append(f"duplicate {kind} in this import")
+            elif keys[kind]:
+                seen_in_batch[kind].add(keys[kind])
+
+        matched_ids = set(matches.values())
+        if len(matched_ids) > 1:
+            reasons.append(f"matches point to different clients: {matches}")
+        elif matches and "email" not in matches:
+            reasons.append(f"{'/'.join(matches)} matches client {matched_ids.pop()} with a different email")
+
+        if reasons:
+            result["conflicting"].append({"client": client, "reasons": reasons, "matches": matches})
+        elif matches:
+            result["existing"].append({"client": client, "client_id": matches["email"]})
+        else:
+            result["new"].append(client)
+
+    return result
+
+
+def check_for_duplicates(clients_list, use_mirror=True):
+    """
+    Classify an import without adding anything
+    """
+    existing, _ = load_existing_clients(use_mirror, clients_list)
+    result = classify_clients(clients_list, build_client_index(existing))
+
+    print(f"\n{'='*80}")
+    print(f"🔎 DEDUP CHECK: {len(clients_list)} rows")
+    print(f"{'='*80}")
+    print(f"🆕 New: {len(result['new'])}")
+    print(f"♻️  Existing: {len(result['existing'])}")
+    print(f"⚠️  Conflicting: {len(result['conflicting'])}")
+    for row in result["existing"]:
+        print(f"   - exists: {row['client'].get('Email')} (ID: {row['client_id']})")
+    for row in result["conflicting"]:
+        print(f"   - conflict: {row['client'].get('Email')}: {'; '.join(row['reasons'])}")
+    return result
+
+
 # ============================================================================
 # ADD CLIENT FUNCTION
 # ============================================================================
@@ -180,7 +390,9 @@ def add_client(client_data, test_mode=True):
     print(f"{'='*80}")
     
     try:
-        response = requests.post(url, headers=HEADERS, json=payload, timeout=30)
+        check_budget()
+        count_call("POST", "/client/addclient", body=payload)
+        response = requests.post(url, headers=HEADERS, json=payload, timeout=upstream_timeout())
         
         print(f"Status Code: {response.status_code}")
         
@@ -236,13 +448,15 @@ def add_client(client_data, test_mode=True):
 # ADD MULTIPLE CLIENTS
 # ============================================================================
 
-def add_multiple_clients(clients_list, test_mode=True):
+def add_multiple_clients(clients_list, test_mode=True, skip_existing=True, use_mirror=True):
     """
     Add multiple clients in batch
     
     Args:
         clients_list: List of client dictionaries
         test_mode: If True, won't actually add to database
+        skip_existing: If True, classify rows first and only add new clients
+        use_mirror: If True, dedup against the local client mirror when fresh
     
     Returns:
         Summary of results
@@ -255,14 +469,35 @@ def add_multiple_clients(clients_list, test_mode=True):
     results = {
         "success": [],
         "failed": [],
+        "skipped": [],
+        "conflicts": [],
         "total": len(clients_list)
     }
     
-    for i, client in enumerate(clients_list, 1):
-        print(f"\n[{i}/{len(clients_list)}] Processing...")
+    to_add = clients_list
+    complete = False
+    if skip_existing:
+        existing, complete = load_existing_clients(use_mirror, clients_list)
+        classified = classify_clients(clients_list, build_client_index(existing))
+        to_add = classified["new"]
+        results["skipped"] = [
+            {"email": row["client"].get("Email"), "client_id": row["client_id"]}
+            for row in classified["existing"]
+        ]
+        results["conflicts"] = [
+            {"email": row["client"].get("Email"), "reasons": row["reasons"]}
+            for row in classified["conflicting"]
+        ]
+        print(f"🔎 {len(to_add)} new, {len(results['skipped'])} existing (skipped), "
+              f"{len(results['conflicts'])} conflicting (skipped)")
+    
+    added = []
+    for i, client in enumerate(to_add, 1):
+        print(f"\n[{i}/{len(to_add)}] Processing...")
         result = add_client(client, test_mode)
         
         if result["success"]:
+            added.append({**{field: client.get(field) for field in MIRROR_FIELDS}, "Id": result.get("client_id")})
             results["success"].append({
                 "name": f"{client['FirstName']} {client['LastName']}",
                 "email": client['Email'],
@@ -275,6 +510,10 @@ def add_multiple_clients(clients_list, test_mode=True):
                 "error": result.get("error")
             })
     
+    # Keep the mirror in step so an immediate re-run skips these rows
+    if complete and added and not test_mode:
+        save_client_mirror(existing + added)
+    
     # Print summary
     print(f"\n{'='*80}")
     print(f"📊 SUMMARY")
@@ -282,6 +521,8 @@ def add_multiple_clients(clients_list, test_mode=True):
     print(f"Total Clients: {results['total']}")
     print(f"✅ Successfully Added: {len(results['success'])}")
     print(f"❌ Failed: {len(results['failed'])}")
+    print(f"♻️  Skipped (already exist): {len(results['skipped'])}")
+    print(f"⚠️  Skipped (conflicts): {len(results['conflicts'])}")
     
     if results['success']:
         print(f"\n✅ Successful Additions:")
@@ -306,21 +547,16 @@ def verify_clients(email_list):
     Verify that clients were added by searching for them
     """
     print(f"\n🔍 VERIFYING CLIENTS...")
-    url = f"{BASE_URL}/client/clients"
-    
     for email in email_list:
-        params = {"SearchText": email, "Limit": 1}
         try:
-            response = requests.get(url, headers=HEADERS, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if "Clients" in data and len(data["Clients"]) > 0:
-                    client = data["Clients"][0]
-                    print(f"✅ Found: {client['FirstName']} {client['LastName']} (ID: {client['Id']})")
-                else:
-                    print(f"❌ Not found: {email}")
+            client = find_client_by_email(email)
         except Exception as e:
             print(f"❌ Error checking {email}: {e}")
+            continue
+        if client:
+            print(f"✅ Found: {client['FirstName']} {client['LastName']} (ID: {client['Id']})")
+        else:
+            print(f"❌ Not found: {email}")
 
 
 # ============================================================================
@@ -328,6 +564,7 @@ def verify_clients(email_list):
 # ============================================================================
 
 if __name__ == "__main__":
+    set_caller("script:add_clients")
     print("\n" + "="*80)
     print("MINDBODY CLIENT ADDITION TOOL")
     print("="*80)
@@ -338,9 +575,10 @@ if __name__ == "__main__":
     print("2. Add clients in LIVE mode (will add to database)")
     print("3. Add custom client")
     print("4. Verify existing clients")
-    print("5. Exit")
+    print("5. Check sample clients for duplicates (no upload)")
+    print("6. Exit")
     
-    choice = input("\nEnter your choice (1-5): ").strip()
+    choice = input("\nEnter your choice (1-6): ").strip()
     
     if choice == "1":
         print("\n🧪 TEST MODE - Adding clients...")
@@ -392,6 +630,9 @@ if __name__ == "__main__":
         verify_clients(emails)
         
     elif choice == "5":
+        check_for_duplicates(SAMPLE_CLIENTS)
+        
+    elif choice == "6":
         print("\n👋 Goodbye!")
     else:
         print("\n❌ Invalid choice!")
\ No newline at end of file
@@ -1,4 +1,12 @@
-from fastapi import FastAPI, Query
+import os
+import json
+from datetime import date, timedelta
+from contextlib import asynccontextmanager
+
+import anyio
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.routing import Match
 from mindbody_client import (
     issue_user_token,
     add_client,
@@ -20,9 +28,259 @@ from mindbody_client import (
     get_accepted_card_types,
     purchase_contract,
     checkout_shopping_cart,
+    bulk_book_class,
+    bulk_remove_clients_from_class,
+    iter_class_schedule,
+    date_shards,
+    SHARD_DAYS,
+)
+from webhooks import verify_signature, handle_event
+from cart_validation import validate_cart
+from outbox import enqueue, get_operation, outbox_stats, start_outbox_workers
+from class_index import CLASS_INDEX, SORTS, ensure_covered, parse_time_of_day, search_range
+from live_classes import event_stream, live_stats
+from deadlines import DeadlineExceeded, route_budget, start_deadline, reset_deadline
+from hedging import hedge_stats
+from negative_cache import negative_cache_stats
+from shared_cache import l2_stats
+from quota import QuotaExceeded, begin_request, end_request, record_request, quota_report
+from tracing import begin_trace, end_trace, span, KIND_SERVER
+from profiling import (
+    ProfiledRoute,
+    is_admin,
+    should_profile,
+    start_profile,
+    stop_profile,
+    set_sample_rate,
+    PROFILING_STATE,
+    profile_path,
+    list_profiles,
+    hot_functions,
 )
+from bulkheads import BulkheadFull, BULKHEAD_RETRY_AFTER, bulkhead_for, bulkhead_stats, total_bulkhead_limit
+from sales_reports import sales_report, sync_sales
+from visit_rollups import (
+    start_rollup_scheduler,
+    start_rollup_job_in_background,
+    rollup_job_status,
+    get_client_rollup,
+    get_inactive_clients,
+)
+
 
-app = FastAPI(title="Mindbody Integration API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start/stop background jobs with the server."""
+    # Bulkheads bound each route category; the shared thread pool must be able
+    # to hold all of them at once so one category can never starve another.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, total_bulkhead_limit())
+
+    rollup_stop = start_rollup_scheduler()
+    outbox_stop = start_outbox_workers()
+    yield
+    outbox_stop.set()
+    if rollup_stop is not None:
+        rollup_stop.set()
+
+
+app = FastAPI(title="Mindbody Integration API", lifespan=lifespan)
+# Every route below can be run under the profiler on demand (see profiling.py)
+app.router.route_class = ProfiledRoute
+
+
+# ============================================================
+# 0) REQUEST ADMISSION - BULKHEADS + DEADLINES
+# ============================================================
+# Long-lived streams hold no worker thread and make no upstream calls of
+# their own, so they skip bulkheads and deadlines.
+STREAMING_ROUTES = {"/classes/live"}
+
+# Responses whose body is produced while it is sent (e.g. /classes?stream=true):
+# their bulkhead slot and call accounting last until the body is done.
+STREAMED_MEDIA_TYPES = ("application/x-ndjson",)
+
+
+def _streams_body(response):
+    return response.headers.get("content-type", "").startswith(STREAMED_MEDIA_TYPES)
+
+
+def _after_body(response, done):
+    """Call done() once the response body is fully sent or the client goes away."""
+    body = response.body_iterator
+
+    async def wrapped():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            done()
+    response.body_iterator = wrapped()
+    return response
+
+
+def _route_path(scope):
+    """Path template of the matching route, e.g. /clients/{client_id}."""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return scope["path"]
+
+
+# Innermost middleware: only marks the request; the route wrapper profiles it.
+@app.middleware("http")
+async def profile_marked_requests(request: Request, call_next):
+    """
+    Profile requests sent with X-Profile: 1 (+ admin token) or picked by
+    the admin sample rate. Adds X-Profile-Id to profiled responses
+    (X-Profile-Skipped when another request held the profiler).
+    """
+    if not should_profile(request.headers, request.url.path):
+        return await call_next(request)
+
+    request_info, token = start_profile(_route_path(request.scope), request.url.path)
+    try:
+        response = await call_next(request)
+        if "skipped" in request_info:
+            response.headers["X-Profile-Skipped"] = request_info["skipped"]
+        else:
+            response.headers["X-Profile-Id"] = request_info["id"]
+        return response
+    finally:
+        stop_profile(token)
+
+
+# Registered before the deadline middleware, so it runs inside it and
+# queue time counts against the route's budget.
+@app.middleware("http")
+async def enforce_bulkheads(request: Request, call_next):
+    """
+    Admit the request into its route category's bulkhead, or reject with 503.
+    """
+    route_path = _route_path(request.scope)
+    if route_path in STREAMING_ROUTES:
+        return await call_next(request)
+    bulkhead = bulkhead_for(request.method, route_path, request.query_params)
+    try:
+        await bulkhead.acquire()
+    except BulkheadFull as e:
+        return JSONResponse(
+            status_code=503,
+            content={"error": str(e), "bulkhead": e.bulkhead.name},
+            headers={"Retry-After": str(BULKHEAD_RETRY_AFTER)},
+        )
+    try:
+        response = await call_next(request)
+    except BaseException:
+        bulkhead.release()
+        raise
+    if _streams_body(response):
+        return _after_body(response, bulkhead.release)
+    bulkhead.release()
+    return response
+
+
+@app.middleware("http")
+async def enforce_route_deadline(request: Request, call_next):
+    """
+    Run every route under its time budget (see deadlines.ROUTE_BUDGETS).
+    Upstream calls derive their timeouts from the time left.
+    """
+    route_path = _route_path(request.scope)
+    if route_path in STREAMING_ROUTES:
+        return await call_next(request)
+    token = start_deadline(route_budget(route_path))
+    try:
+        return await call_next(request)
+    finally:
+        reset_deadline(token)
+
+
+@app.middleware("http")
+async def account_upstream_calls(request: Request, call_next):
+    """
+    Tag upstream Mindbody calls with this route (see quota.py) and record
+    how many calls the request made.
+    """
+    route_path = _route_path(request.scope)
+    if route_path in STREAMING_ROUTES:
+        return await call_next(request)
+    calls, tokens = begin_request(f"route:{request.method} {route_path}", request.url.path)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        record_request(calls)
+        raise
+    finally:
+        end_request(tokens)
+    # in-memory; flushed to quota.db in the background
+    if _streams_body(response):
+        return _after_body(response, lambda: record_request(calls))
+    record_request(calls)
+    return response
+
+
+# Registered last, so it is the outermost middleware and the root span
+# covers bulkhead queueing and the deadline scope.
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """
+    Root span per request; trace ID from `traceparent` or generated,
+    returned in the X-Trace-Id header.
+    """
+    trace, token = begin_trace(request.headers)
+    if trace is None:
+        return await call_next(request)
+
+    route_path = _route_path(request.scope)
+    try:
+        with span(f"{request.method} {route_path}", KIND_SERVER, **{
+            "http.method": request.method,
+            "http.route": route_path,
+            "http.target": request.url.path,
+            "http.request_id": request.headers.get("X-Request-ID"),
+        }) as root:
+            response = await call_next(request)
+            root.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                root.set_error(f"HTTP {response.status_code}")
+            response.headers["X-Trace-Id"] = trace.trace_id
+            return response
+    finally:
+        end_trace(trace, token)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    """Fast, well-formed 504 instead of a hung worker."""
+    content = {"error": str(exc)}
+    if exc.deadline is not None:
+        content["budget_seconds"] = exc.deadline.budget
+        content["elapsed_seconds"] = round(exc.deadline.elapsed(), 3)
+        content["partial"] = exc.deadline.partial
+    return JSONResponse(status_code=504, content=content)
+
+
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceeded):
+    """Route (or job) is over its upstream call budget."""
+    return JSONResponse(
+        status_code=429,
+        content={"error": str(exc), "caller": exc.caller, "period": exc.bucket,
+                 "used": exc.used, "budget": exc.budget},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _accepted(kind, payload, order_key):
+    """Queue a write in the durable outbox and answer 202 immediately."""
+    operation_id = enqueue(kind, payload, order_key)
+    return JSONResponse(status_code=202, content={
+        "operation_id": operation_id,
+        "status": "pending",
+        "status_url": f"/operations/{operation_id}",
+    })
 
 
 # ============================================================
@@ -41,11 +299,18 @@ def generate_token(username: str, password: str):
 # 2) ADD CLIENT
 # ============================================================
 @app.post("/clients/add")
-def create_new_client(client: dict):
+def create_new_client(
+    client: dict,
+    async_mode: bool = Query(False, alias="async", description="Queue in the outbox and return 202")
+):
     """
     Add a new client to MINDBODY sandbox.
     Requires staff token (auto-generated internally).
+    With ?async=true the write is queued; poll /operations/{operation_id}.
     """
+    if async_mode:
+        email = (client.get("Email") or "").strip().lower()
+        return _accepted("add_client", {"client_data": client}, f"email:{email}" if email else None)
     return add_client(client)
 
 
@@ -75,27 +340,158 @@ def client_visits(client_id: str):
 # ============================================================
 # 5) GET CLASS SCHEDULE
 # ============================================================
+def _iso_dates(*values):
+    """True if every value starts with a YYYY-MM-DD date."""
+    try:
+        for value in values:
+            date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
 @app.get("/classes")
 def fetch_classes(
     start_date: str = Query(None, description="YYYY-MM-DD"),
-    end_date: str = Query(None, description="YYYY-MM-DD")
+    end_date: str = Query(None, description="YYYY-MM-DD"),
+    shard: str = Query(None, description="Split the range into concurrent 'day' or 'week' fetches"),
+    stream: bool = Query(False, description="With shard: NDJSON, one line per shard as it finishes")
 ):
     """
     Fetch class schedule between optional dates.
     MINDBODY sandbox (-99) already contains sample classes.
+
+    Wide ranges: /classes?start_date=2025-12-01&end_date=2025-12-31&shard=week
     """
-    return get_class_schedule(start_date, end_date)
+    if shard is None:
+        return get_class_schedule(start_date, end_date)
+    if shard not in SHARD_DAYS or not _iso_dates(start_date, end_date):
+        return {"error": f"shard needs YYYY-MM-DD start_date and end_date and one of: {', '.join(SHARD_DAYS)}"}
+
+    if not stream:
+        return get_class_schedule(start_date, end_date, shard=shard)
+
+    def lines():
+        # Runs under the route's deadline after the 200 went out, so a timeout
+        # ends the stream with an error line instead of a 504.
+        sent = 0
+        try:
+            for shard_start, shard_end, data in iter_class_schedule(start_date, end_date, shard):
+                yield json.dumps({"start_date": shard_start, "end_date": shard_end, **data}) + "\n"
+                sent += 1
+        except (DeadlineExceeded, QuotaExceeded) as e:
+            yield json.dumps({"error": str(e), "shards_sent": sent,
+                              "shards_total": len(date_shards(start_date, end_date, shard))}) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# ============================================================
+# 5b) SEARCH CLASS SCHEDULE (server-side index)
+# ============================================================
+@app.get("/classes/search")
+def search_classes(
+    q: str = Query(None, description="Class name words"),
+    instructor: str = Query(None, description="Instructor name words"),
+    staff_id: int = Query(None, description="Instructor ID"),
+    location: str = Query(None, description="Location name words"),
+    location_id: int = Query(None, description="Location ID"),
+    start_date: str = Query(None, description="YYYY-MM-DD"),
+    end_date: str = Query(None, description="YYYY-MM-DD"),
+    time_from: str = Query(None, description="Earliest start time of day, HH:MM"),
+    time_to: str = Query(None, description="Latest start time of day, HH:MM"),
+    min_open_spots: int = Query(None, description="Only classes with at least this many spots"),
+    include_cancelled: bool = Query(False, description="Include cancelled classes"),
+    sort: str = Query("start", description="start, open_spots or name"),
+    limit: int = Query(50, description="Results limit"),
+    offset: int = Query(0, description="Results offset"),
+    refresh: bool = Query(False, description="Re-fetch the schedule for start_date..end_date first")
+):
+    """
+    Filter, sort and page the class schedule from an in-memory index.
+    The index is updated whenever the schedule is fetched from Mindbody
+    (e.g. via GET /classes); days of the searched range (default: the next
+    week) it does not hold yet are fetched before searching. Ranges outside
+    the index window (CLASS_INDEX_PAST_DAYS back, CLASS_INDEX_MAX_DAYS ahead)
+    are rejected with 400.
+
+    Example: /classes/search?instructor=ashley&time_from=17:00&min_open_spots=1
+    """
+    if sort not in SORTS:
+        return {"error": f"Invalid sort. Use: {', '.join(SORTS)}"}
+    try:
+        minutes_from = parse_time_of_day(time_from) if time_from else None
+        minutes_to = parse_time_of_day(time_to) if time_to else None
+    except ValueError:
+        return {"error": "time_from / time_to must be HH:MM"}
+
+    if (start_date and not _iso_dates(start_date)) or (end_date and not _iso_dates(end_date)):
+        return {"error": "start_date / end_date must be YYYY-MM-DD"}
+    try:
+        search_range(start_date, end_date)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    ensure_covered(start_date, end_date, refresh)
+
+    return CLASS_INDEX.search(
+        q=q, instructor=instructor, staff_id=staff_id, location=location, location_id=location_id,
+        start_date=start_date, end_date=end_date, time_from=minutes_from, time_to=minutes_to,
+        min_open_spots=min_open_spots, include_cancelled=include_cancelled,
+        sort=sort, limit=limit, offset=offset,
+    )
+
+
+# ============================================================
+# 5c) LIVE CLASS CAPACITY (server-sent events)
+# ============================================================
+LIVE_MAX_DAYS = int(os.getenv("LIVE_MAX_DAYS", "31"))
+
+
+@app.get("/classes/live")
+async def live_class_capacity(
+    start_date: str = Query(None, description="YYYY-MM-DD (default today)"),
+    end_date: str = Query(None, description="YYYY-MM-DD (default start + 6 days)"),
+    class_ids: str = Query(None, description="Comma-separated class IDs to watch (default all in range)")
+):
+    """
+    Stream capacity/status changes for classes in a date range as SSE.
+    One shared upstream poller per date range serves every subscriber.
+
+    Example (browser): new EventSource("/classes/live?class_ids=1234,1235")
+    Events: `snapshot` once, then `changes` with only the changed fields.
+    """
+    try:
+        start = date.fromisoformat(start_date) if start_date else date.today()
+        end = date.fromisoformat(end_date) if end_date else start + timedelta(days=6)
+        ids = [int(x) for x in class_ids.split(",") if x.strip()] if class_ids else None
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Dates must be YYYY-MM-DD and class_ids integers"})
+    if end < start or (end - start).days >= LIVE_MAX_DAYS:
+        return JSONResponse(status_code=400, content={"error": f"Range must be 1-{LIVE_MAX_DAYS} days"})
+
+    return StreamingResponse(
+        event_stream(start.isoformat(), end.isoformat(), ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ============================================================
 # 6) BOOK A CLASS
 # ============================================================
 @app.post("/classes/book")
-def book_class_for_client(client_id: str, class_id: int):
+def book_class_for_client(
+    client_id: str,
+    class_id: int,
+    async_mode: bool = Query(False, alias="async", description="Queue in the outbox and return 202")
+):
     """
     Book a client into a class.
     Requires staff token (auto-handled).
+    With ?async=true the booking is queued; poll /operations/{operation_id}.
     """
+    if async_mode:
+        return _accepted("book_class", {"client_id": client_id, "class_id": class_id}, f"client:{client_id}")
     return book_class(client_id, class_id)
 
 
@@ -129,11 +525,19 @@ def list_clients(
 # 9) PHASE 1 - UPDATE CLIENT
 # ============================================================
 @app.put("/clients/{client_id}")
-def update_existing_client(client_id: str, client_data: dict):
+def update_existing_client(
+    client_id: str,
+    client_data: dict,
+    async_mode: bool = Query(False, alias="async", description="Queue in the outbox and return 202")
+):
     """
     Update existing client information.
     Provide only the fields you want to update.
+    With ?async=true the update is queued; poll /operations/{operation_id}.
     """
+    if async_mode:
+        return _accepted("update_client", {"client_id": client_id, "client_data": client_data},
+                         f"client:{client_id}")
     return update_client(client_id, client_data)
 
 
@@ -180,12 +584,22 @@ def book_appointment(
     session_type_id: int,
     location_id: int,
     staff_id: int,
-    start_datetime: str = Query(..., description="YYYY-MM-DDTHH:MM:SS")
+    start_datetime: str = Query(..., description="YYYY-MM-DDTHH:MM:SS"),
+    async_mode: bool = Query(False, alias="async", description="Queue in the outbox and return 202")
 ):
     """
     Book an appointment for a client.
     start_datetime format: 2025-12-03T14:30:00
+    With ?async=true the booking is queued; poll /operations/{operation_id}.
     """
+    if async_mode:
+        return _accepted("add_appointment", {
+            "client_id": client_id,
+            "session_type_id": session_type_id,
+            "location_id": location_id,
+            "staff_id": staff_id,
+            "start_datetime": start_datetime,
+        }, f"client:{client_id}")
     return add_appointment(client_id, session_type_id, location_id, staff_id, start_datetime)
 
 # ============================================================
@@ -198,6 +612,7 @@ def handle_sales_get(
     session_type_id: int = Query(None, description="Filter by session type (for services only)"),
     start_date: str = Query(None, description="Start date for sales history (YYYY-MM-DD)"),
     end_date: str = Query(None, description="End date for sales history (YYYY-MM-DD)"),
+    shard: str = Query(None, description="Sales only: fetch the range as concurrent 'day' or 'week' shards"),
     limit: int = Query(100, description="Results limit"),
     offset: int = Query(0, description="Results offset")
 ):
@@ -210,6 +625,7 @@ def handle_sales_get(
     - /sale?action=products → View retail products
     - /sale?action=packages → View service packages
     - /sale?action=sales&start_date=2025-12-01 → View transaction history
+    - /sale?action=sales&start_date=2025-01-01&end_date=2025-03-31&shard=week → wide range, concurrent shards
     - /sale?action=cardtypes → View accepted payment methods
     """
     
@@ -226,7 +642,9 @@ def handle_sales_get(
         return get_packages(location_id, limit, offset)
     
     elif action == "sales":
-        return get_sales(start_date, end_date, limit, offset)
+        if shard is not None and (shard not in SHARD_DAYS or not _iso_dates(start_date, end_date)):
+            return {"error": f"shard needs YYYY-MM-DD start_date and end_date and one of: {', '.join(SHARD_DAYS)}"}
+        return get_sales(start_date, end_date, limit, offset, shard=shard)
     
     elif action == "cardtypes":
         return get_accepted_card_types()
@@ -274,6 +692,10 @@ def handle_sales_post(
          },
          "test": false
        }
+       Items may also use Mindbody's shape:
+         {"Item": {"Type": "Service", "Metadata": {"Id": 123}}, "Quantity": 1}
+       Carts that fail local checks (unknown items, wrong total, unaccepted
+       or invalid card) are rejected with 422 before reaching Mindbody.
     """
     
     if not data:
@@ -288,6 +710,9 @@ def handle_sales_post(
         )
     
     elif action == "checkout":
+        problems = validate_cart(data.get("client_id"), data.get("items"), data.get("payment_info"))
+        if problems:
+            return JSONResponse(status_code=422, content={"error": "Cart failed validation", "problems": problems})
         return checkout_shopping_cart(
             client_id=data.get("client_id"),
             items=data.get("items"),
@@ -296,4 +721,340 @@ def handle_sales_post(
         )
     
     else:
-        return {"error": "Invalid action. Use: purchase_contract or checkout"}
\ No newline at end of file
+        return {"error": "Invalid action. Use: purchase_contract or checkout"}
+
+
+# ============================================================
+# 15) BULK CLASS BOOKING / CANCELLATION
+# ============================================================
+def _booking_pairs(data):
+    """
+    Accept either {"class_id": 1, "client_ids": [...]}
+    or {"bookings": [{"client_id": "...", "class_id": 1}, ...]}.
+    Returns a list of (client_id, class_id) or None if the shape is wrong.
+    """
+    if not data:
+        return None
+    if "bookings" in data:
+        try:
+            return [(str(b["client_id"]), int(b["class_id"])) for b in data["bookings"]]
+        except (KeyError, TypeError, ValueError):
+            return None
+    if "class_id" in data and isinstance(data.get("client_ids"), list):
+        try:
+            class_id = int(data["class_id"])
+        except (TypeError, ValueError):
+            return None
+        return [(str(client_id), class_id) for client_id in data["client_ids"]]
+    return None
+
+
+@app.post("/classes/book/bulk")
+def bulk_book_classes(data: dict = None):
+    """
+    Book many clients at once (group / corporate bookings).
+
+    Body (either form):
+       {"class_id": 123, "client_ids": ["100015630", "100015631"]}
+       {"bookings": [{"client_id": "100015630", "class_id": 123}, ...]}
+
+    Bookings run concurrently (BULK_MAX_CONCURRENCY). Once a class reports
+    full, remaining bookings for it are skipped. Returns per-client outcomes.
+    """
+    pairs = _booking_pairs(data)
+    if pairs is None:
+        return {"error": "Body must contain class_id + client_ids, or bookings"}
+    return bulk_book_class(pairs)
+
+
+@app.post("/classes/cancel/bulk")
+def bulk_cancel_class_bookings(data: dict = None):
+    """
+    Cancel many bookings at once (e.g. instructor called in sick).
+
+    Body: same forms as /classes/book/bulk, plus optional "late_cancel": true
+    """
+    pairs = _booking_pairs(data)
+    if pairs is None:
+        return {"error": "Body must contain class_id + client_ids, or bookings"}
+    return bulk_remove_clients_from_class(pairs, bool(data.get("late_cancel", False)))
+
+
+# ============================================================
+# 16) SALES REPORTS (incremental, per-day partitions)
+# ============================================================
+@app.get("/reports/sales")
+def sales_report_summary(
+    start_date: str = Query(..., description="YYYY-MM-DD"),
+    end_date: str = Query(..., description="YYYY-MM-DD"),
+    group_by: str = Query("day", description="day, location, item_type, payment_method")
+):
+    """
+    Revenue report from the local per-day sales store.
+    Only missing days and the last few (still changing) days are fetched
+    from Mindbody; older days are read from disk.
+
+    Example: /reports/sales?start_date=2025-01-01&end_date=2025-12-31&group_by=location
+    """
+    try:
+        return sales_report(start_date, end_date, group_by)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Dates must be YYYY-MM-DD"})
+    except RuntimeError as e:
+        return {"error": str(e)}
+
+
+@app.post("/reports/sales/refresh")
+def refresh_sales_report(
+    start_date: str = Query(..., description="YYYY-MM-DD"),
+    end_date: str = Query(..., description="YYYY-MM-DD"),
+    force: bool = Query(False, description="Re-fetch every day, not just recent ones")
+):
+    """
+    Ingest sales for a range into the local store without building a report.
+    Use force=true after a backdated correction in Mindbody.
+    """
+    try:
+        return sync_sales(start_date, end_date, force)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Dates must be YYYY-MM-DD"})
+    except RuntimeError as e:
+        return {"error": str(e)}
+
+
+# ============================================================
+# 17) VISIT / ATTENDANCE ROLLUPS (local, no upstream calls)
+# ============================================================
+@app.post("/rollups/refresh")
+def refresh_visit_rollups():
+    """
+    Start one incremental rollup pass in the background.
+    Runs automatically every ROLLUP_INTERVAL_MINUTES when that is set.
+    """
+    return start_rollup_job_in_background()
+
+
+@app.get("/rollups/status")
+def visit_rollup_status():
+    """
+    Show whether the rollup job is running and how the last pass went.
+    """
+    return rollup_job_status()
+
+
+@app.get("/rollups/inactive")
+def inactive_clients(
+    days: int = Query(30, description="No visit in this many days"),
+    include_never: bool = Query(False, description="Also list clients with no visits at all"),
+    limit: int = Query(100, description="Results limit"),
+    offset: int = Query(0, description="Results offset")
+):
+    """
+    Clients with no attended visit in the last N days (retention list).
+    """
+    return get_inactive_clients(days, include_never, limit, offset)
+
+
+@app.get("/rollups/clients/{client_id}")
+def client_visit_rollup(
+    client_id: str,
+    weeks: int = Query(12, description="Weeks of visits-per-week history")
+):
+    """
+    Visit frequency, streaks, last visit, no-show and late-cancel rates.
+    """
+    rollup = get_client_rollup(client_id, weeks)
+    if rollup is None:
+        return {"error": "No rollup for this client yet. Run POST /rollups/refresh"}
+    return rollup
+
+
+# ============================================================
+# 18) ADMIN - UPSTREAM HEDGING STATS
+# ============================================================
+@app.get("/admin/hedging")
+def hedging_stats():
+    """
+    Hedged GET counters, remaining hedge budget and per-endpoint thresholds.
+    """
+    return hedge_stats()
+
+
+# ============================================================
+# 19) ADMIN - BULKHEAD SATURATION
+# ============================================================
+@app.get("/admin/bulkheads")
+def bulkhead_saturation():
+    """
+    Per-category concurrency: limit, in flight, waiting, rejections, waits.
+    """
+    return bulkhead_stats()
+
+
+# ============================================================
+# 20) ADMIN - ON-DEMAND PROFILING (requires X-Admin-Token)
+# ============================================================
+def require_admin(x_admin_token: str = Header(None)):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=401, detail="Valid X-Admin-Token required")
+
+
+@app.get("/admin/profiling", dependencies=[Depends(require_admin)])
+def profiling_status():
+    """
+    Current profiling sample rate.
+    """
+    return PROFILING_STATE
+
+
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)])
+def configure_profiling(
+    sample_rate: float = Query(..., description="Fraction of requests to profile (0 turns it off)")
+):
+    """
+    Profile a sample of all requests, e.g. sample_rate=0.05 for 5%.
+    Single requests can also opt in with headers X-Profile: 1 + X-Admin-Token.
+    """
+    return set_sample_rate(sample_rate)
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def recent_profiles(limit: int = Query(50, description="Number of profiles to list")):
+    """
+    Most recent stored profiles (id, route, duration).
+    """
+    return list_profiles(limit)
+
+
+@app.get("/admin/profiles/hot", dependencies=[Depends(require_admin)])
+def hot_function_stats(
+    window_seconds: int = Query(300, description="Aggregate profiles from this many seconds back"),
+    limit: int = Query(30, description="Number of functions"),
+    sort: str = Query("tottime", description="tottime, cumtime or calls")
+):
+    """
+    Hottest functions across all profiles captured in the window.
+    """
+    return hot_functions(window_seconds, limit, sort)
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """
+    Download a .prof file (open with pstats, snakeviz, etc.).
+    """
+    path = profile_path(profile_id)
+    if not profile_id.isalnum() or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+
+# ============================================================
+# 21) ASYNC WRITE OPERATIONS (outbox status)
+# ============================================================
+@app.get("/operations/{operation_id}")
+def operation_status(operation_id: str):
+    """
+    Status of a write queued with ?async=true:
+    pending → in_progress → succeeded / failed (result holds the Mindbody response).
+    """
+    operation = get_operation(operation_id)
+    if operation is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown operation"})
+    return operation
+
+
+@app.get("/admin/outbox")
+def outbox_summary():
+    """
+    Outbox operation counts by status.
+    """
+    return outbox_stats()
+
+
+# ============================================================
+# 22) ADMIN - NEGATIVE CACHE
+# ============================================================
+@app.get("/admin/negative-cache")
+def negative_cache_summary():
+    """
+    Negative cache hits/misses, Bloom filter generations and memory, allow-set size.
+    """
+    return negative_cache_stats()
+
+
+# ============================================================
+# 23) ADMIN - LIVE CAPACITY FEEDS
+# ============================================================
+@app.get("/admin/live")
+def live_feed_summary():
+    """
+    Live capacity pollers: one per date range, with subscriber counts.
+    """
+    return live_stats()
+
+
+# ============================================================
+# 24) ADMIN - SHARED CACHE
+# ============================================================
+@app.get("/admin/cache")
+def shared_cache_summary():
+    """
+    Host-wide L2 cache size (entries, bytes, eviction threshold).
+    """
+    return l2_stats()
+
+
+# ============================================================
+# 25) ADMIN - UPSTREAM QUOTA
+# ============================================================
+@app.get("/admin/quota")
+def upstream_quota(
+    day: str = Query(None, description="YYYY-MM-DD (default today)"),
+    n_plus_one_limit: int = Query(50, description="Most recent N+1 flags to include")
+):
+    """
+    Upstream Mindbody calls by route/job and endpoint, budget usage,
+    calls per inbound request, and recent N+1 patterns.
+    """
+    return quota_report(day, n_plus_one_limit)
+
+
+# ============================================================
+# 26) MINDBODY WEBHOOKS (cache invalidation)
+# ============================================================
+@app.head("/webhooks/mindbody")
+def validate_webhook_url():
+    """
+    Mindbody sends a HEAD request to validate the URL on subscription.
+    """
+    return Response(status_code=200)
+
+
+@app.post("/webhooks/mindbody")
+async def receive_mindbody_webhook(request: Request):
+    """
+    Receive a Mindbody webhook event and update cached records.
+
+    Handled events:
+    - client.created → clear the ID from the negative cache
+    - client.updated / client.deactivated → patch or drop cached client
+    - classRosterBooking.created / .cancelled → patch class capacity
+    - classRosterBookingStatus.updated → drop cached client
+    - clientSale.created → drop cached sales
+
+    Try it locally with: python send_test_webhook.py
+    """
+    raw_body = await request.body()
+    if not verify_signature(raw_body, request.headers.get("X-Mindbody-Signature")):
+        return JSONResponse(status_code=401, content={"error": "Invalid webhook signature"})
+
+    try:
+        event = json.loads(raw_body)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Body must be JSON"})
+    if not isinstance(event, dict) or not isinstance(event.get("eventData") or {}, dict):
+        return JSONResponse(status_code=400, content={"error": "Body and eventData must be JSON objects"})
+
+    # Cache patching does SQLite I/O and unpickling; keep it off the event loop
+    return await anyio.to_thread.run_sync(handle_event, event)
@@ -0,0 +1,160 @@
+"""
+Bulkhead isolation for app.py routes.
+
+Each route category gets its own concurrency limit and bounded wait queue,
+so a burst of slow reporting calls cannot take the worker threads that
+bookings and check-in lookups need. Requests beyond the queue (or waiting
+longer than BULKHEAD_QUEUE_TIMEOUT) are rejected with BulkheadFull, which
+app.py turns into a 503 with Retry-After.
+
+Override limits with BULKHEADS='{"reporting": {"limit": 2, "queue": 4}}'.
+"""
+
+import os
+import json
+import time
+import asyncio
+from collections import deque
+
+BULKHEAD_QUEUE_TIMEOUT = float(os.getenv("BULKHEAD_QUEUE_TIMEOUT", "5"))
+BULKHEAD_RETRY_AFTER = int(os.getenv("BULKHEAD_RETRY_AFTER", "2"))
+
+BULKHEAD_LIMITS = {
+    "booking": {"limit": 16, "queue": 32},
+    "client_reads": {"limit": 16, "queue": 64},
+    "catalog": {"limit": 8, "queue": 32},
+    "reporting": {"limit": 4, "queue": 8},
+    "admin": {"limit": 4, "queue": 8},
+    "default": {"limit": 8, "queue": 16},
+}
+for _name, _override in json.loads(os.getenv("BULKHEADS", "{}")).items():
+    BULKHEAD_LIMITS[_name] = {**BULKHEAD_LIMITS.get(_name, BULKHEAD_LIMITS["default"]), **_override}
+
+# (method, route path) -> category
+ROUTE_CATEGORIES = {
+    ("POST", "/classes/book"): "booking",
+    ("POST", "/classes/book/bulk"): "booking",
+    ("POST", "/classes/cancel/bulk"): "booking",
+    ("DELETE", "/classes/booking"): "booking",
+    ("POST", "/appointments/book"): "booking",
+    ("POST", "/clients/add"): "booking",
+    ("PUT", "/clients/{client_id}"): "booking",
+    ("POST", "/sale"): "booking",
+    ("GET", "/clients"): "client_reads",
+    ("GET", "/clients/{client_id}"): "client_reads",
+    ("GET", "/clients/{client_id}/visits"): "client_reads",
+    ("GET", "/clients/{client_id}/attendance"): "client_reads",
+    ("GET", "/rollups/clients/{client_id}"): "client_reads",
+    ("GET", "/rollups/inactive"): "client_reads",
+    ("GET", "/operations/{operation_id}"): "client_reads",
+    ("GET", "/classes"): "catalog",
+    ("GET", "/classes/search"): "catalog",
+    ("GET", "/appointments/slots"): "catalog",
+    ("GET", "/sale"): "catalog",
+    ("GET", "/reports/sales"): "reporting",
+    ("POST", "/reports/sales/refresh"): "reporting",
+    ("POST", "/rollups/refresh"): "reporting",
+    ("GET", "/rollups/status"): "reporting",
+    ("POST", "/token"): "admin",
+    ("POST", "/webhooks/mindbody"): "admin",
+}
+
+
+class BulkheadFull(Exception):
+    def __init__(self, bulkhead):
+        super().__init__(f"Bulkhead '{bulkhead.name}' is saturated")
+        self.bulkhead = bulkhead
+
+
+class Bulkhead:
+    """
+    Concurrency limit + FIFO wait queue. Only touched from the event loop,
+    so plain counters are enough; waiters are loop futures.
+    """
+
+    def __init__(self, name, limit, queue):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.in_flight = 0
+        self._waiters = deque()
+        self.stats = {"admitted": 0, "rejected": 0, "timed_out": 0,
+                      "max_in_flight": 0, "max_waiting": 0, "wait_seconds": 0.0}
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self._admit(0.0)
+            return
+        if len(self._waiters) >= self.queue:
+            self.stats["rejected"] += 1
+            raise BulkheadFull(self)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], len(self._waiters))
+        started = time.monotonic()
+        try:
+            # release() hands its slot straight to the next waiter
+            await asyncio.wait_for(waiter, BULKHEAD_QUEUE_TIMEOUT)
+        except BaseException as e:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if waiter.done() and not waiter.cancelled():
+                self.release()   # slot was handed over just as we gave up
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timed_out"] += 1
+                self.stats["rejected"] += 1
+                raise BulkheadFull(self)
+            raise
+        self.in_flight -= 1   # _admit counts it again
+        self._admit(time.monotonic() - started)
+
+    def _admit(self, waited):
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        self.stats["wait_seconds"] += waited
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)   # slot stays counted in in_flight
+                return
+        self.in_flight -= 1
+
+    def snapshot(self):
+        admitted = self.stats["admitted"]
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "saturation": round(self.in_flight / self.limit, 3) if self.limit else None,
+            **{k: v for k, v in self.stats.items() if k != "wait_seconds"},
+            "avg_wait_ms": round(self.stats["wait_seconds"] / admitted * 1000, 2) if admitted else 0.0,
+        }
+
+
+BULKHEADS = {name: Bulkhead(name, cfg["limit"], cfg["queue"]) for name, cfg in BULKHEAD_LIMITS.items()}
+
+
+def route_category(method, route_path, query_params=None):
+    """Category for a route; GET /sale?action=sales counts as reporting."""
+    if method == "GET" and route_path == "/sale" and (query_params or {}).get("action") == "sales":
+        return "reporting"
+    if route_path.startswith("/admin/"):
+        return "admin"
+    return ROUTE_CATEGORIES.get((method, route_path), "default")
+
+
+def bulkhead_for(method, route_path, query_params=None):
+    return BULKHEADS[route_category(method, route_path, query_params)]
+
+
+def total_bulkhead_limit():
+    return sum(b.limit for b in BULKHEADS.values())
+
+
+def bulkhead_stats():
+    return {name: bulkhead.snapshot() for name, bulkhead in BULKHEADS.items()}
@@ -0,0 +1,155 @@
+"""
+Two-tier TTL cache for Mindbody read responses.
+
+Entries are grouped by namespace ("client", "class_schedule", "sales",
+"catalog") so a webhook event can invalidate or patch every cached response
+it affects.
+A TTL of 0 disables caching for that namespace.
+
+Client, schedule and sales entries default to an hour only when Mindbody
+webhooks are configured (MINDBODY_WEBHOOK_SIGNATURE_KEY) to invalidate
+them on upstream changes; without webhooks they default to
+CACHE_TTL_UNSIGNED seconds. This app's own writes invalidate what they
+touch either way (see mindbody_client.py).
+
+With CACHE_L2=1 (default) the dict is an L1 in front of the host-wide
+SQLite tier in shared_cache.py: L1 misses are filled from L2, writes and
+invalidations go to both. L1 entries live at most CACHE_L1_MAX_TTL so an
+invalidation made by another worker (webhooks reach only one) shows up
+here within that time.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+
+from shared_cache import l2_get, l2_set, l2_items, l2_keys, l2_invalidate, l2_patch
+
+load_dotenv()
+
+WEBHOOKS_CONFIGURED = bool(os.getenv("MINDBODY_WEBHOOK_SIGNATURE_KEY"))
+CACHE_TTL_UNSIGNED = os.getenv("CACHE_TTL_UNSIGNED", "60")
+_WEBHOOK_TTL = "3600" if WEBHOOKS_CONFIGURED else CACHE_TTL_UNSIGNED
+
+CACHE_TTL = {
+    "client": int(os.getenv("CACHE_TTL_CLIENT", _WEBHOOK_TTL)),
+    "class_schedule": int(os.getenv("CACHE_TTL_CLASS_SCHEDULE", _WEBHOOK_TTL)),
+    "sales": int(os.getenv("CACHE_TTL_SALES", _WEBHOOK_TTL)),
+    "catalog": int(os.getenv("CACHE_TTL_CATALOG", "3600")),
+}
+CACHE_L2 = os.getenv("CACHE_L2", "1") == "1"
+CACHE_L1_MAX_TTL = int(os.getenv("CACHE_L1_MAX_TTL", "30"))
+
+# (namespace, key) -> (expires_at, value)
+_CACHE = {}
+_LOCK = threading.Lock()
+
+
+def _l2(fn, *args, default=None):
+    """Call the shared tier; a busy or broken cache file degrades to L1 only."""
+    if not CACHE_L2:
+        return default
+    try:
+        return fn(*args)
+    except sqlite3.Error as e:
+        print(f"⚠️ Shared cache unavailable: {e}")
+        return default
+
+
+def _l1_expiry(expires_at):
+    return min(expires_at, time.time() + CACHE_L1_MAX_TTL) if CACHE_L2 else expires_at
+
+
+# ============================================================
+# 1) READ / WRITE
+# ============================================================
+def cache_get(namespace, key):
+    """Return the cached value (L1, then L2), or None if missing or expired."""
+    with _LOCK:
+        entry = _CACHE.get((namespace, key))
+        if entry is not None:
+            expires_at, value = entry
+            if time.time() < expires_at:
+                return value
+            del _CACHE[(namespace, key)]
+
+    entry = _l2(l2_get, namespace, key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    with _LOCK:
+        _CACHE[(namespace, key)] = (_l1_expiry(expires_at), value)
+    return value
+
+
+def cache_set(namespace, key, value, ttl=None):
+    """Store a value for the namespace's TTL (or an explicit ttl)."""
+    if ttl is None:
+        ttl = CACHE_TTL.get(namespace, 0)
+    if ttl <= 0:
+        return
+    expires_at = time.time() + ttl
+    with _LOCK:
+        _CACHE[(namespace, key)] = (_l1_expiry(expires_at), value)
+    _l2(l2_set, namespace, key, value, expires_at)
+
+
+def cache_items(namespace):
+    """List (key, value) pairs for all live entries in a namespace (L1 wins over L2)."""
+    now = time.time()
+    with _LOCK:
+        items = {
+            key: value
+            for (ns, key), (expires_at, value) in _CACHE.items()
+            if ns == namespace and now < expires_at
+        }
+    for key, _, value in _l2(l2_items, namespace, default=[]):
+        items.setdefault(key, value)
+    return list(items.items())
+
+
+def cache_keys(namespace):
+    """Keys of all live entries in a namespace (both tiers); values are not loaded."""
+    now = time.time()
+    with _LOCK:
+        keys = {key for (ns, key), (expires_at, _) in _CACHE.items() if ns == namespace and now < expires_at}
+    keys.update(_l2(l2_keys, namespace, default=[]))
+    return list(keys)
+
+
+# ============================================================
+# 2) INVALIDATE / PATCH
+# ============================================================
+def cache_invalidate(namespace, key=None):
+    """Drop one entry, or the whole namespace when key is None (both tiers)."""
+    with _LOCK:
+        if key is not None:
+            dropped = 1 if _CACHE.pop((namespace, key), None) is not None else 0
+        else:
+            doomed = [k for k in _CACHE if k[0] == namespace]
+            for k in doomed:
+                del _CACHE[k]
+            dropped = len(doomed)
+    return max(dropped, _l2(l2_invalidate, namespace, key, default=0))
+
+
+def cache_patch(namespace, key, patch_fn):
+    """
+    Replace a cached value with patch_fn(value), keeping its expiry.
+    patch_fn must return a new object; readers may still hold the old one.
+    Returns True if an entry was patched in either tier.
+    """
+    with _LOCK:
+        entry = _CACHE.get((namespace, key))
+        patched = entry is not None and time.time() < entry[0]
+        if patched:
+            _CACHE[(namespace, key)] = (entry[0], patch_fn(entry[1]))
+    return _l2(l2_patch, namespace, key, patch_fn, default=False) or patched
+
+
+def is_cacheable(data):
+    """Only successful JSON payloads are cached, never errors or raw bodies."""
+    return isinstance(data, dict) and "Error" not in data and "raw" not in data
@@ -0,0 +1,337 @@
+"""
+Local pre-validation of checkout carts.
+
+POST /sale?action=checkout runs validate_cart() before calling
+checkout_shopping_cart. Items, totals and the payment card are checked
+against the cached catalog (services, products, packages, contracts and
+accepted card types), so a cart that is clearly wrong is rejected with a
+422 without an upstream round trip.
+
+Only clear problems are reported: anything the local data cannot decide
+(unknown item types, tips/gift cards, discounts, catalogs that failed to
+load) is left for Mindbody to judge. Cached prices can be stale, so a
+payment total that does not match is re-checked against a fresh catalog
+(fetched now or within CART_MISS_REFRESH_SECONDS) before it is rejected.
+"""
+
+import os
+import re
+import time
+import threading
+from datetime import date
+
+from mindbody_client import (
+    get_services,
+    get_products,
+    get_packages,
+    get_contracts,
+    get_accepted_card_types,
+)
+
+CART_VALIDATION = os.getenv("CART_VALIDATION", "1") == "1"
+CART_CATALOG_PAGE_SIZE = int(os.getenv("CART_CATALOG_PAGE_SIZE", "200"))
+CART_INDEX_TTL = int(os.getenv("CART_INDEX_TTL", "60"))
+CART_MISS_REFRESH_SECONDS = int(os.getenv("CART_MISS_REFRESH_SECONDS", "300"))
+CART_MAX_TAX_RATE = float(os.getenv("CART_MAX_TAX_RATE", "0.25"))
+
+# cart item type -> (response list key, catalog getter)
+CATALOGS = {
+    "service": ("Services", get_services),
+    "product": ("Products", get_products),
+    "package": ("Packages", get_packages),
+    "contract": ("Contracts", get_contracts),
+}
+
+# card brand -> accepted-card-type names it may appear as (normalized)
+CARD_BRANDS = {
+    "visa": {"visa"},
+    "mastercard": {"mastercard", "mc"},
+    "amex": {"amex", "americanexpress"},
+    "discover": {"discover"},
+    "diners": {"diners", "dinersclub"},
+    "jcb": {"jcb"},
+}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]")
+
+# catalog type -> (built_at, {id: catalog item}) ; None index = catalog unavailable
+_INDEXES = {}
+_LAST_FORCED = {}
+_LOCK = threading.Lock()
+
+
+# ============================================================
+# 1) CATALOG INDEXES
+# ============================================================
+def _load_catalog(item_type, use_cache):
+    """Page through a catalog (cached pages); None if any page errored."""
+    list_key, getter = CATALOGS[item_type]
+    items, offset = [], 0
+    while True:
+        page = getter(limit=CART_CATALOG_PAGE_SIZE, offset=offset, use_cache=use_cache)
+        if not isinstance(page, dict) or "Error" in page or "raw" in page:
+            return None
+        batch = page.get(list_key) or []
+        items.extend(batch)
+        offset += len(batch)
+        total = (page.get("PaginationResponse") or {}).get("TotalResults")
+        if len(batch) < CART_CATALOG_PAGE_SIZE or (total is not None and offset >= total):
+            return items
+
+
+def _catalog_index(item_type, refresh=False):
+    """Id -> catalog item; rebuilt from the response cache every CART_INDEX_TTL."""
+    entry = _INDEXES.get(item_type)
+    if entry is not None and not refresh and time.time() - entry[0] < CART_INDEX_TTL:
+        return entry[1]
+
+    items = _load_catalog(item_type, use_cache=not refresh)
+    index = None
+    if items is not None:
+        index = {}
+        for item in items:
+            # Cart metadata may use either the catalog Id or its ProductId
+            for field in ("Id", "ProductId"):
+                if item.get(field) is not None:
+                    index[str(item[field])] = item
+    _INDEXES[item_type] = (time.time(), index)
+    return index
+
+
+def _force_refresh(item_type):
+    """
+    Refetch a catalog from Mindbody, at most once per CART_MISS_REFRESH_SECONDS.
+    Returns the index if it was refetched now or within that window, else None.
+    """
+    with _LOCK:
+        now = time.time()
+        recent = now - _LAST_FORCED.get(item_type, 0) < CART_MISS_REFRESH_SECONDS
+        if not recent:
+            _LAST_FORCED[item_type] = now
+    if recent:
+        return _catalog_index(item_type)
+    return _catalog_index(item_type, refresh=True)
+
+
+def _lookup(item_type, item_id):
+    """
+    Find a catalog item. On a miss the catalog is refetched from Mindbody
+    (at most once per CART_MISS_REFRESH_SECONDS) so new items are not rejected.
+    Returns (found item or None, catalog available).
+    """
+    index = _catalog_index(item_type)
+    if index is None:
+        return None, False
+    if item_id in index:
+        return index[item_id], True
+
+    index = _force_refresh(item_type)
+    if index is None:
+        return None, False
+    return index.get(item_id), True
+
+
+def _accepted_card_types():
+    data = get_accepted_card_types()
+    if isinstance(data, dict):
+        data = data.get("CardTypes") or data.get("AcceptedCardTypes")
+    if not isinstance(data, list) or not data:
+        return None
+    return {_NON_ALNUM.sub("", str(name).lower()) for name in data}
+
+
+# ============================================================
+# 2) CART SHAPE
+# ============================================================
+def _cart_item(raw):
+    """
+    Accept {"Type", "Id", "Quantity"} or Mindbody's
+    {"Item": {"Type", "Metadata": {"Id"}}, "Quantity"}.
+    Returns (type, id, quantity, metadata).
+    """
+    item = raw.get("Item") if isinstance(raw.get("Item"), dict) else raw
+    metadata = item.get("Metadata") if isinstance(item.get("Metadata"), dict) else item
+    item_id = metadata.get("Id")
+    return (
+        str(item.get("Type") or ""),
+        str(item_id) if item_id is not None else None,
+        raw.get("Quantity", 1),
+        metadata,
+    )
+
+
+def _payments(payment_info):
+    """
+    Accept a single {"Amount", "Method", "CardNumber", ...} dict or a list of
+    Mindbody {"Type", "Metadata": {...}} payments.
+    Returns the list of payment metadata dicts.
+    """
+    if isinstance(payment_info, dict):
+        payment_info = [payment_info]
+    payments = []
+    for payment in payment_info or []:
+        if not isinstance(payment, dict):
+            continue
+        payments.append(payment.get("Metadata") if isinstance(payment.get("Metadata"), dict) else payment)
+    return payments
+
+
+def _price_range(catalog_item):
+    prices = [p for p in (catalog_item.get("Price"), catalog_item.get("OnlinePrice"))
+              if isinstance(p, (int, float))]
+    return (min(prices), max(prices)) if prices else None
+
+
+# ============================================================
+# 3) CARD CHECKS
+# ============================================================
+def _luhn_ok(digits):
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        n = int(ch)
+        if i % 2:
+            n = n * 2 - 9 if n > 4 else n * 2
+        total += n
+    return total % 10 == 0
+
+
+def card_brand(digits):
+    """Card brand from the BIN (None when unrecognised)."""
+    if digits.startswith("4"):
+        return "visa"
+    if 51 <= int(digits[:2]) <= 55 or 2221 <= int(digits[:4]) <= 2720:
+        return "mastercard"
+    if digits[:2] in ("34", "37"):
+        return "amex"
+    if digits.startswith("6011") or digits.startswith("65") or 644 <= int(digits[:3]) <= 649:
+        return "discover"
+    if digits[:2] in ("36", "38") or 300 <= int(digits[:3]) <= 305:
+        return "diners"
+    if 3528 <= int(digits[:4]) <= 3589:
+        return "jcb"
+    return None
+
+
+def _card_problems(label, metadata, today):
+    number = metadata.get("CreditCardNumber") or metadata.get("CardNumber")
+    if not number:
+        return []
+    digits = re.sub(r"[\s-]", "", str(number))
+    if not digits.isdigit() or not 12 <= len(digits) <= 19 or not _luhn_ok(digits):
+        return [f"{label}: card number is not valid"]
+
+    problems = []
+    try:
+        month, year = int(metadata.get("ExpMonth")), int(metadata.get("ExpYear"))
+        year += 2000 if year < 100 else 0
+        if (year, month) < (today.year, today.month):
+            problems.append(f"{label}: card expired {month:02d}/{year}")
+    except (TypeError, ValueError):
+        pass
+
+    brand = card_brand(digits)
+    accepted = _accepted_card_types() if brand else None
+    if accepted is not None and not CARD_BRANDS[brand] & accepted:
+        problems.append(f"{label}: {brand} cards are not accepted")
+    return problems
+
+
+# ============================================================
+# 4) VALIDATION
+# ============================================================
+def validate_cart(client_id, items, payment_info):
+    """Return a list of problems; an empty list means the cart may go upstream."""
+    if not CART_VALIDATION:
+        return []
+
+    problems = []
+    if not client_id:
+        problems.append("client_id is required")
+    if not isinstance(items, list) or not items:
+        return problems + ["items must be a non-empty list"]
+
+    priced = []   # (catalog type, item id, quantity) of items with a known catalog price
+    totals_known = True
+    for i, raw in enumerate(items):
+        label = f"items[{i}]"
+        if not isinstance(raw, dict):
+            problems.append(f"{label}: must be an object")
+            totals_known = False
+            continue
+        item_type, item_id, quantity, metadata = _cart_item(raw)
+
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            problems.append(f"{label}: Quantity must be a positive integer")
+            totals_known = False
+            continue
+
+        kind = item_type.lower()
+        if kind not in CATALOGS:
+            totals_known = False   # tips, gift cards, ... are Mindbody's call
+            continue
+        if item_id is None:
+            problems.append(f"{label}: {item_type} Id is required")
+            totals_known = False
+            continue
+
+        catalog_item, available = _lookup(kind, item_id)
+        if not available:
+            totals_known = False
+            continue
+        if catalog_item is None:
+            problems.append(f"{label}: {item_type} {item_id} does not exist")
+            totals_known = False
+            continue
+
+        if _price_range(catalog_item) is None or metadata.get("DiscountAmount") or raw.get("DiscountAmount"):
+            totals_known = False
+            continue
+        priced.append((kind, item_id, quantity))
+
+    payments = _payments(payment_info)
+    if not payments:
+        problems.append("payment_info is required")
+
+    today = date.today()
+    paid, amounts_known = 0.0, bool(payments)
+    for i, metadata in enumerate(payments):
+        label = "payment_info" if isinstance(payment_info, dict) else f"payment_info[{i}]"
+        amount = metadata.get("Amount")
+        if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+            if amount <= 0:
+                problems.append(f"{label}: Amount must be positive")
+            paid += amount
+        else:
+            amounts_known = False
+        problems.extend(_card_problems(label, metadata, today))
+
+    if totals_known and amounts_known and not problems:
+        bounds = _cart_bounds(priced, {kind: _catalog_index(kind) for kind, _, _ in priced})
+        if bounds is not None and not _total_matches(paid, *bounds):
+            # Cached prices may be stale: only reject against a fresh catalog
+            bounds = _cart_bounds(priced, {kind: _force_refresh(kind) for kind, _, _ in priced})
+            if bounds is not None and not _total_matches(paid, *bounds):
+                low, high = bounds
+                problems.append(
+                    f"payment total {paid:.2f} does not match cart total "
+                    f"{low:.2f}" + (f"-{high:.2f}" if high != low else "") + " (before tax)"
+                )
+    return problems
+
+
+def _cart_bounds(priced, indexes):
+    """(cheapest, priciest) cart total from these indexes, or None if an item/price is gone."""
+    low = high = 0.0
+    for kind, item_id, quantity in priced:
+        catalog_item = (indexes.get(kind) or {}).get(item_id)
+        prices = _price_range(catalog_item) if catalog_item is not None else None
+        if prices is None:
+            return None
+        low += prices[0] * quantity
+        high += prices[1] * quantity
+    return low, high
+
+
+def _total_matches(paid, low, high):
+    # Tax is not known locally, so only amounts outside [cheapest, priciest + max tax] fail
+    return round(low, 2) - 0.01 <= paid <= round(high * (1 + CART_MAX_TAX_RATE), 2) + 0.01
@@ -0,0 +1,326 @@
+"""
+In-memory searchable index over the class schedule.
+
+Built from get_class_schedule payloads: inverted indexes on class name,
+staff and location tokens/ids, plus sorted start-datetime and time-of-day
+arrays searched with bisect. Every fresh schedule fetch is fed in through
+mindbody_client.SCHEDULE_LISTENERS, and only classes whose data changed are
+re-indexed. Serves GET /classes/search.
+
+The index remembers which days it holds a schedule for; ensure_covered()
+fetches any day of a searched range that is missing or older than
+CLASS_INDEX_COVERAGE_TTL before the search runs. Searches are limited to
+the window from CLASS_INDEX_PAST_DAYS ago to CLASS_INDEX_MAX_DAYS ahead,
+and classes outside it are evicted, so memory and upstream calls are bounded
+by the window rather than by whatever range a caller asks for.
+"""
+
+import os
+import re
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+
+from cache import CACHE_TTL
+from mindbody_client import SCHEDULE_LISTENERS, get_class_schedule
+
+CLASS_INDEX_PAST_DAYS = int(os.getenv("CLASS_INDEX_PAST_DAYS", "7"))
+CLASS_INDEX_DEFAULT_DAYS = int(os.getenv("CLASS_INDEX_DEFAULT_DAYS", "7"))
+CLASS_INDEX_MAX_DAYS = int(os.getenv("CLASS_INDEX_MAX_DAYS", "31"))
+CLASS_INDEX_COVERAGE_TTL = int(os.getenv("CLASS_INDEX_COVERAGE_TTL", str(CACHE_TTL["class_schedule"])))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+SORTS = ("start", "open_spots", "name")
+
+
+def _tokens(*texts):
+    tokens = set()
+    for text in texts:
+        if text:
+            tokens.update(_TOKEN.findall(str(text).lower()))
+    return tokens
+
+
+def _minutes(start):
+    """Minutes since midnight from 'YYYY-MM-DDTHH:MM...'."""
+    try:
+        return int(start[11:13]) * 60 + int(start[14:16])
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_time_of_day(value):
+    """'HH:MM' -> minutes since midnight (raises ValueError)."""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class ClassIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._classes = {}      # class id -> raw class dict
+        self._records = {}      # class id -> normalized record
+        self._postings = {"name": {}, "staff": {}, "staff_id": {}, "location": {}, "location_id": {}}
+        self._by_start = []     # sorted (start iso, class id)
+        self._by_minutes = []   # sorted (minutes since midnight, class id)
+        self._covered = {}      # day (YYYY-MM-DD) -> when its schedule was last indexed
+
+    # --------------------------------------------------------
+    # indexing
+    # --------------------------------------------------------
+    def _record(self, cls):
+        description = cls.get("ClassDescription") or {}
+        staff = cls.get("Staff") or {}
+        location = cls.get("Location") or {}
+        start = str(cls.get("StartDateTime") or "")
+        max_capacity, booked = cls.get("MaxCapacity"), cls.get("TotalBooked")
+        staff_name = staff.get("DisplayName") or staff.get("Name") or \
+            f"{staff.get('FirstName') or ''} {staff.get('LastName') or ''}".strip()
+        return {
+            "name": description.get("Name") or cls.get("Name") or "",
+            "postings": {
+                "name": _tokens(description.get("Name"), cls.get("Name")),
+                "staff": _tokens(staff_name),
+                "staff_id": {str(staff["Id"])} if staff.get("Id") is not None else set(),
+                "location": _tokens(location.get("Name")),
+                "location_id": {str(location["Id"])} if location.get("Id") is not None else set(),
+            },
+            "start": start,
+            "minutes": _minutes(start),
+            "open_spots": max_capacity - booked if max_capacity is not None and booked is not None else None,
+            "cancelled": bool(cls.get("IsCanceled")),
+        }
+
+    def _remove(self, class_id):
+        record = self._records.pop(class_id, None)
+        self._classes.pop(class_id, None)
+        if record is None:
+            return
+        for field, keys in record["postings"].items():
+            for key in keys:
+                ids = self._postings[field].get(key)
+                if ids is not None:
+                    ids.discard(class_id)
+                    if not ids:
+                        del self._postings[field][key]
+        self._discard_sorted(self._by_start, (record["start"], class_id))
+        if record["minutes"] is not None:
+            self._discard_sorted(self._by_minutes, (record["minutes"], class_id))
+
+    @staticmethod
+    def _discard_sorted(entries, entry):
+        i = bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def _add(self, class_id, cls):
+        record = self._record(cls)
+        self._classes[class_id] = cls
+        self._records[class_id] = record
+        for field, keys in record["postings"].items():
+            for key in keys:
+                self._postings[field].setdefault(key, set()).add(class_id)
+        insort(self._by_start, (record["start"], class_id))
+        if record["minutes"] is not None:
+            insort(self._by_minutes, (record["minutes"], class_id))
+
+    def upsert(self, cls):
+        class_id = cls.get("Id")
+        if class_id is None or self._classes.get(class_id) == cls:
+            return False
+        self._remove(class_id)
+        self._add(class_id, cls)
+        return True
+
+    def update_from_schedule(self, data, start_date=None, end_date=None):
+        """
+        Re-index only classes that changed. When the fetch covered a known
+        date range, classes in that range that disappeared are dropped.
+        """
+        classes = data.get("Classes") if isinstance(data, dict) else None
+        if classes is None:
+            return {"changed": 0, "removed": 0}
+
+        with self._lock:
+            seen = set()
+            changed = 0
+            for cls in classes:
+                seen.add(cls.get("Id"))
+                changed += self.upsert(cls)
+
+            removed = 0
+            if start_date and end_date:
+                low = bisect_left(self._by_start, (start_date,))
+                high = bisect_left(self._by_start, (end_date + "T99",))
+                stale = [cid for _, cid in self._by_start[low:high] if cid not in seen]
+                for class_id in stale:
+                    self._remove(class_id)
+                removed = len(stale)
+                now = time.time()
+                for day in _days(start_date, end_date):
+                    self._covered[day] = now
+        return {"changed": changed, "removed": removed}
+
+    def missing_ranges(self, start_date, end_date, max_age):
+        """Contiguous (start, end) day runs not indexed within the last max_age seconds."""
+        cutoff = time.time() - max_age
+        runs = []
+        with self._lock:
+            for day in _days(start_date, end_date):
+                if self._covered.get(day, 0) > cutoff:
+                    continue
+                if runs and date.fromisoformat(day) - date.fromisoformat(runs[-1][1]) == timedelta(days=1):
+                    runs[-1][1] = day
+                else:
+                    runs.append([day, day])
+        return [tuple(run) for run in runs]
+
+    def evict_outside(self, first_day, last_day):
+        """Drop classes starting outside first_day..last_day and forget those days were covered."""
+        with self._lock:
+            low = bisect_left(self._by_start, (first_day,))
+            high = bisect_left(self._by_start, (last_day + "T99",))
+            outside = [cid for _, cid in self._by_start[:low] + self._by_start[high:]]
+            for class_id in outside:
+                self._remove(class_id)
+            for covered_day in [d for d in self._covered if not first_day <= d <= last_day]:
+                del self._covered[covered_day]
+        return len(outside)
+
+    def adjust_booked(self, class_id, total_booked=None, delta=0):
+        """Keep open spots current from booking webhooks."""
+        with self._lock:
+            cls = self._classes.get(class_id)
+            if cls is None:
+                return False
+            if total_booked is None:
+                total_booked = max((cls.get("TotalBooked") or 0) + delta, 0)
+            return self.upsert({**cls, "TotalBooked": total_booked})
+
+    def __len__(self):
+        return len(self._classes)
+
+    # --------------------------------------------------------
+    # search
+    # --------------------------------------------------------
+    def _token_match(self, field, text):
+        """Classes containing every token of `text` (token prefixes allowed)."""
+        result = None
+        postings = self._postings[field]
+        for token in _tokens(text):
+            ids = set()
+            if token in postings:
+                ids |= postings[token]
+            for key, key_ids in postings.items():
+                if key != token and key.startswith(token):
+                    ids |= key_ids
+            result = ids if result is None else result & ids
+        return result if result is not None else set()
+
+    def search(self, q=None, instructor=None, staff_id=None, location=None, location_id=None,
+               start_date=None, end_date=None, time_from=None, time_to=None,
+               min_open_spots=None, include_cancelled=False,
+               sort="start", limit=50, offset=0):
+        with self._lock:
+            candidates = []
+            if q:
+                candidates.append(self._token_match("name", q))
+            if instructor:
+                candidates.append(self._token_match("staff", instructor))
+            if staff_id is not None:
+                candidates.append(self._postings["staff_id"].get(str(staff_id), set()))
+            if location:
+                candidates.append(self._token_match("location", location))
+            if location_id is not None:
+                candidates.append(self._postings["location_id"].get(str(location_id), set()))
+            if start_date or end_date:
+                low = bisect_left(self._by_start, (start_date,)) if start_date else 0
+                high = bisect_left(self._by_start, (end_date + "T99",)) if end_date else len(self._by_start)
+                candidates.append({cid for _, cid in self._by_start[low:high]})
+            if time_from is not None or time_to is not None:
+                low = bisect_left(self._by_minutes, (time_from,)) if time_from is not None else 0
+                high = bisect_right(self._by_minutes, (time_to, float("inf"))) if time_to is not None \
+                    else len(self._by_minutes)
+                candidates.append({cid for _, cid in self._by_minutes[low:high]})
+
+            if candidates:
+                candidates.sort(key=len)
+                ids = set(candidates[0]).intersection(*candidates[1:])
+            else:
+                ids = set(self._records)
+
+            records = self._records
+            matches = [
+                cid for cid in ids
+                if (include_cancelled or not records[cid]["cancelled"])
+                and (min_open_spots is None
+                     or (records[cid]["open_spots"] is not None and records[cid]["open_spots"] >= min_open_spots))
+            ]
+
+            if sort == "open_spots":
+                matches.sort(key=lambda cid: (-(records[cid]["open_spots"] or 0), records[cid]["start"]))
+            elif sort == "name":
+                matches.sort(key=lambda cid: (records[cid]["name"].lower(), records[cid]["start"]))
+            else:
+                matches.sort(key=lambda cid: (records[cid]["start"], str(cid)))
+
+            page = [self._classes[cid] for cid in matches[offset:offset + limit]]
+        return {"total": len(matches), "limit": limit, "offset": offset, "classes": page}
+
+
+def _days(start_date, end_date):
+    """Inclusive YYYY-MM-DD days of a range (start/end may carry a time part)."""
+    try:
+        start, end = date.fromisoformat(start_date[:10]), date.fromisoformat(end_date[:10])
+    except (TypeError, ValueError):
+        return []
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+CLASS_INDEX = ClassIndex()
+SCHEDULE_LISTENERS.append(CLASS_INDEX.update_from_schedule)
+
+
+def index_window_start():
+    """Earliest day the index keeps classes for."""
+    return (date.today() - timedelta(days=CLASS_INDEX_PAST_DAYS)).isoformat()
+
+
+def index_window_end():
+    """Latest day the index keeps classes for."""
+    return (date.today() + timedelta(days=CLASS_INDEX_MAX_DAYS - 1)).isoformat()
+
+
+def search_range(start_date=None, end_date=None):
+    """
+    (start, end) days a search covers (default: today + CLASS_INDEX_DEFAULT_DAYS).
+    Raises ValueError when the range falls outside the index window.
+    """
+    start = start_date[:10] if start_date else date.today().isoformat()
+    end = end_date[:10] if end_date else \
+        (date.fromisoformat(start) + timedelta(days=CLASS_INDEX_DEFAULT_DAYS - 1)).isoformat()
+    first, last = index_window_start(), index_window_end()
+    if start < first:
+        raise ValueError(f"start_date must be on or after {first} (past classes are not indexed)")
+    if end > last:
+        raise ValueError(f"end_date must be on or before {last} (at most {CLASS_INDEX_MAX_DAYS} days ahead)")
+    return start, end
+
+
+def ensure_covered(start_date=None, end_date=None, refresh=False):
+    """
+    Make sure the index holds a current schedule for start_date..end_date
+    (see search_range), fetching only missing/old days. Returns the
+    (start, end) ranges that were fetched.
+    """
+    start, end = search_range(start_date, end_date)
+    CLASS_INDEX.evict_outside(index_window_start(), index_window_end())
+    ranges = [(start, end)] if refresh else CLASS_INDEX.missing_ranges(start, end, CLASS_INDEX_COVERAGE_TTL)
+    for range_start, range_end in ranges:
+        shard = "week" if range_start != range_end else None
+        data = get_class_schedule(range_start, range_end, use_cache=not refresh, shard=shard)
+        # Cached responses do not reach SCHEDULE_LISTENERS, so index them here
+        CLASS_INDEX.update_from_schedule(data, range_start, range_end)
+    return ranges
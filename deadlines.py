@@ -0,0 +1,117 @@
+"""
+End-to-end deadlines for upstream Mindbody calls.
+
+Each app.py route runs under a Deadline (its per-route budget). Every
+upstream call derives its connect/read timeouts from the time left, so a
+stuck connection can never outlive the route. When time runs out a
+DeadlineExceeded is raised; app.py turns it into a 504 carrying whatever
+partial results the route recorded with record_partial().
+
+Calls made outside a route (scripts, background jobs) have no deadline and
+use UPSTREAM_TIMEOUT_SECONDS.
+"""
+
+import os
+import json
+import time
+import contextvars
+
+DEFAULT_ROUTE_BUDGET = float(os.getenv("ROUTE_BUDGET_SECONDS", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3.05"))
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "30"))
+
+# Routes that legitimately fan out or page through many upstream calls
+ROUTE_BUDGETS = {
+    "/classes/book/bulk": 30.0,
+    "/classes/cancel/bulk": 30.0,
+    "/reports/sales": 120.0,
+    "/reports/sales/refresh": 300.0,
+    # Override or extend with ROUTE_BUDGETS='{"/clients/{client_id}": 5}'
+    **json.loads(os.getenv("ROUTE_BUDGETS", "{}")),
+}
+
+_CURRENT = contextvars.ContextVar("mindbody_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The route's time budget ran out before an upstream call could finish."""
+
+    def __init__(self, message="Upstream deadline exceeded", deadline=None):
+        super().__init__(message)
+        self.deadline = deadline
+
+
+class Deadline:
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+        self.partial = {}
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+
+# ============================================================
+# 1) ROUTE SCOPE
+# ============================================================
+def route_budget(route_path: str):
+    return float(ROUTE_BUDGETS.get(route_path, DEFAULT_ROUTE_BUDGET))
+
+
+def start_deadline(budget: float):
+    """Set the deadline for the current request; returns a reset token."""
+    return _CURRENT.set(Deadline(budget))
+
+
+def reset_deadline(token):
+    _CURRENT.reset(token)
+
+
+def current_deadline():
+    return _CURRENT.get()
+
+
+def submit_with_context(pool, fn, *args, **kwargs):
+    """
+    pool.submit() that carries the caller's context (deadline etc.) into the
+    worker thread. Each task gets its own copy; the Deadline object is shared.
+    """
+    ctx = contextvars.copy_context()
+    return pool.submit(ctx.run, fn, *args, **kwargs)
+
+
+# ============================================================
+# 2) UPSTREAM TIMEOUTS
+# ============================================================
+def upstream_timeout():
+    """
+    (connect, read) timeout for requests, bounded by the time left.
+    Raises DeadlineExceeded if the budget is already spent.
+    """
+    deadline = _CURRENT.get()
+    if deadline is None:
+        return (min(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_TIMEOUT_SECONDS), UPSTREAM_TIMEOUT_SECONDS)
+
+    left = deadline.remaining()
+    if left <= 0:
+        raise DeadlineExceeded(deadline=deadline)
+    return (min(UPSTREAM_CONNECT_TIMEOUT, left), left)
+
+
+def deadline_exceeded_from_timeout(error):
+    """Translate a requests timeout into DeadlineExceeded when a route deadline is active."""
+    deadline = _CURRENT.get()
+    if deadline is None:
+        return error
+    return DeadlineExceeded(f"Upstream call timed out: {error}", deadline=deadline)
+
+
+def record_partial(key, value):
+    """Keep a partial result so a 504 can still return work already done."""
+    deadline = _CURRENT.get()
+    if deadline is not None:
+        deadline.partial[key] = value
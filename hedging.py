@@ -0,0 +1,167 @@
+"""
+Hedged requests for idempotent Mindbody GETs.
+
+If a GET has not answered within the HEDGE_PERCENTILE of that endpoint's
+recent latency, a second identical request is sent; whichever response
+arrives first wins. A token budget caps hedges at HEDGE_MAX_FRACTION of
+calls.
+
+requests cannot abort a call in flight, so the losing attempt runs on
+until it answers or its timeout (bounded by the route deadline) fires.
+Attempts run on a dedicated pool of HEDGE_POOL_SIZE threads and never
+queue for it: when every thread is taken (e.g. by slow losers) calls run
+unhedged in the caller's own thread instead.
+
+Opt-in: MINDBODY_HEDGE_ENABLED=true, or mb_request(..., hedge=True).
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from deadlines import submit_with_context
+
+HEDGE_ENABLED = os.getenv("MINDBODY_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MAX_FRACTION = float(os.getenv("HEDGE_MAX_FRACTION", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.05"))
+HEDGE_WINDOW = 200          # latencies kept per endpoint
+HEDGE_BURST = 10.0          # max hedge tokens saved up
+
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", "32"))
+
+_POOL = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="mb-hedge")
+_SLOTS = threading.BoundedSemaphore(HEDGE_POOL_SIZE)   # one per running attempt
+_LOCK = threading.Lock()
+_LATENCIES = {}   # endpoint -> deque of seconds
+_STATS = {"calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0, "pool_busy": 0}
+_tokens = HEDGE_BURST
+
+
+# ============================================================
+# 1) LATENCY TRACKING + BUDGET
+# ============================================================
+def record_latency(endpoint, seconds):
+    with _LOCK:
+        samples = _LATENCIES.get(endpoint)
+        if samples is None:
+            samples = _LATENCIES[endpoint] = deque(maxlen=HEDGE_WINDOW)
+        samples.append(seconds)
+
+
+def hedge_delay(endpoint):
+    """Latency percentile to wait before hedging, or None if too few samples."""
+    with _LOCK:
+        samples = sorted(_LATENCIES.get(endpoint) or ())
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    index = min(int(len(samples) * HEDGE_PERCENTILE / 100), len(samples) - 1)
+    return max(samples[index], HEDGE_MIN_DELAY)
+
+
+def _earn_token():
+    global _tokens
+    with _LOCK:
+        _STATS["calls"] += 1
+        _tokens = min(_tokens + HEDGE_MAX_FRACTION, HEDGE_BURST)
+
+
+def _spend_token():
+    global _tokens
+    with _LOCK:
+        if _tokens < 1:
+            _STATS["budget_denied"] += 1
+            return False
+        _tokens -= 1
+        _STATS["hedged"] += 1
+        return True
+
+
+def _refund_token():
+    """A hedge that was paid for but could not start."""
+    global _tokens
+    with _LOCK:
+        _tokens = min(_tokens + 1, HEDGE_BURST)
+        _STATS["hedged"] -= 1
+
+
+def hedge_stats():
+    with _LOCK:
+        delays = {}
+        for endpoint, samples in _LATENCIES.items():
+            ordered = sorted(samples)
+            delays[endpoint] = {
+                "samples": len(ordered),
+                "p50": ordered[len(ordered) // 2] if ordered else None,
+                "hedge_after": None,
+            }
+        stats = dict(_STATS, tokens=round(_tokens, 2), enabled=HEDGE_ENABLED)
+    for endpoint in delays:
+        delays[endpoint]["hedge_after"] = hedge_delay(endpoint)
+    return {**stats, "endpoints": delays}
+
+
+# ============================================================
+# 2) HEDGED SEND
+# ============================================================
+def _attempt(send):
+    """Run one attempt on a pool thread; frees its slot when it finishes."""
+    try:
+        started = time.monotonic()
+        response = send()
+        return response, time.monotonic() - started
+    finally:
+        _SLOTS.release()
+
+
+def _submit(send):
+    """Start an attempt if a pool thread is free (never queue behind losers)."""
+    if not _SLOTS.acquire(blocking=False):
+        with _LOCK:
+            _STATS["pool_busy"] += 1
+        return None
+    return submit_with_context(_POOL, _attempt, send)
+
+
+def hedged_request(endpoint, send):
+    """
+    send() performs one GET and returns a requests.Response.
+    Returns the first successful response among the primary and the hedge.
+    """
+    _earn_token()
+    delay = hedge_delay(endpoint)
+    primary = _submit(send) if delay is not None else None
+    if primary is None:
+        started = time.monotonic()
+        response = send()
+        record_latency(endpoint, time.monotonic() - started)
+        return response
+
+    attempts = [primary]
+    done, _ = wait(attempts, timeout=delay)
+    if not done and _spend_token():
+        hedge = _submit(send)
+        if hedge is None:
+            _refund_token()
+        else:
+            attempts.append(hedge)
+
+    pending = set(attempts)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            response, elapsed = future.result()
+            record_latency(endpoint, elapsed)
+            if future is not primary:
+                with _LOCK:
+                    _STATS["hedge_wins"] += 1
+            # The other attempt, if any, finishes on its own and is discarded
+            return response
+    raise error
@@ -0,0 +1,188 @@
+"""
+Live class capacity over server-sent events (GET /classes/live).
+
+Subscribers pick a date range and optionally a set of class IDs. Each date
+range has one shared poller task that calls get_class_schedule every
+LIVE_POLL_SECONDS, diffs the capacity/status fields against the previous
+poll and pushes only what changed to every subscriber's queue, so upstream
+load is one schedule call per range per interval however many browser tabs
+are watching. The poller stops when its last subscriber leaves.
+
+Events:
+- snapshot: current fields for every (subscribed) class, sent once on join
+- changes: {"classes": [...]} with only the fields that changed;
+  classes that disappeared from the schedule come as {"Id": ..., "Removed": true}
+"""
+
+import os
+import json
+import time
+import asyncio
+import contextvars
+
+from mindbody_client import get_class_schedule
+from quota import tagged
+
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "5"))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+
+LIVE_FIELDS = (
+    "MaxCapacity", "WebCapacity", "TotalBooked", "WebBooked",
+    "TotalBookedWaitlist", "IsAvailable", "IsCanceled", "IsWaitlistAvailable",
+)
+
+_POLLERS = {}   # (start_date, end_date) -> RangePoller
+
+
+class Subscriber:
+    def __init__(self, class_ids=None):
+        self.class_ids = set(class_ids) if class_ids else None
+        self.queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+        self.primed = False
+        self.dropped = False
+
+    def wants(self, class_id):
+        return self.class_ids is None or class_id in self.class_ids
+
+    def push(self, event, classes):
+        if self.dropped:
+            return
+        classes = [c for c in classes if self.wants(c["Id"])]
+        if event == "changes" and not classes:
+            return
+        try:
+            self.queue.put_nowait((event, {"classes": classes}))
+        except asyncio.QueueFull:
+            # Too slow to keep up: end its stream, the client reconnects for a fresh snapshot
+            self.dropped = True
+
+
+class RangePoller:
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.subscribers = set()
+        self.state = None        # class id -> {field: value}; None until the first poll
+        self.polls = 0
+        self.errors = 0
+        self.last_poll_at = None
+        self.task = None
+
+    def _fetch(self):
+        with tagged("job:live-classes"):
+            return get_class_schedule(self.start_date, self.end_date, use_cache=False)
+
+    @staticmethod
+    def _fields(cls):
+        return {field: cls[field] for field in LIVE_FIELDS if field in cls}
+
+    def _diff(self, data):
+        current = {}
+        for cls in data.get("Classes") or []:
+            if cls.get("Id") is not None:
+                current[cls["Id"]] = self._fields(cls)
+
+        changes = []
+        previous = self.state or {}
+        for class_id, fields in current.items():
+            old = previous.get(class_id)
+            if old is None:
+                changes.append({"Id": class_id, **fields})
+            elif old != fields:
+                changes.append({"Id": class_id, **{k: v for k, v in fields.items() if old.get(k) != v}})
+        for class_id in previous.keys() - current.keys():
+            changes.append({"Id": class_id, "Removed": True})
+        self.state = current
+        return changes
+
+    def snapshot(self):
+        return [{"Id": class_id, **fields} for class_id, fields in (self.state or {}).items()]
+
+    def publish(self, changes):
+        snapshot = None
+        for subscriber in list(self.subscribers):
+            if not subscriber.primed:
+                snapshot = snapshot if snapshot is not None else self.snapshot()
+                subscriber.push("snapshot", snapshot)
+                subscriber.primed = True
+            elif changes:
+                subscriber.push("changes", changes)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while self.subscribers:
+            try:
+                data = await loop.run_in_executor(None, self._fetch)
+            except Exception as e:
+                data = {"Error": str(e)}
+            self.polls += 1
+            self.last_poll_at = time.time()
+            if isinstance(data, dict) and "Classes" in data:
+                self.publish(self._diff(data))
+            else:
+                self.errors += 1
+                print(f"❌ Live schedule poll failed for {self.start_date}..{self.end_date}: {data}")
+            await asyncio.sleep(LIVE_POLL_SECONDS)
+
+
+# ============================================================
+# 1) SUBSCRIBE / UNSUBSCRIBE (event loop only)
+# ============================================================
+def subscribe(start_date, end_date, class_ids=None):
+    key = (start_date, end_date)
+    poller = _POLLERS.get(key)
+    if poller is None:
+        poller = _POLLERS[key] = RangePoller(start_date, end_date)
+    subscriber = Subscriber(class_ids)
+    poller.subscribers.add(subscriber)
+    if poller.state is not None:
+        poller.publish([])   # primes just this subscriber with the current snapshot
+    if poller.task is None or poller.task.done():
+        # Fresh context: the poller outlives the request that started it, so it
+        # must not inherit that request's deadline, trace or profile markers.
+        poller.task = asyncio.get_running_loop().create_task(poller.run(), context=contextvars.Context())
+    return poller, subscriber
+
+
+def unsubscribe(poller, subscriber):
+    poller.subscribers.discard(subscriber)
+    if not poller.subscribers:
+        if poller.task is not None:
+            poller.task.cancel()
+        if _POLLERS.get((poller.start_date, poller.end_date)) is poller:
+            del _POLLERS[(poller.start_date, poller.end_date)]
+
+
+async def event_stream(start_date, end_date, class_ids=None):
+    """Async generator of SSE frames for one subscriber."""
+    poller, subscriber = subscribe(start_date, end_date, class_ids)
+    try:
+        yield "retry: 3000\n\n"
+        while not subscriber.dropped or not subscriber.queue.empty():
+            try:
+                event, payload = await asyncio.wait_for(subscriber.queue.get(), LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    finally:
+        unsubscribe(poller, subscriber)
+
+
+def live_stats():
+    return {
+        "poll_seconds": LIVE_POLL_SECONDS,
+        "ranges": [
+            {
+                "start_date": poller.start_date,
+                "end_date": poller.end_date,
+                "subscribers": len(poller.subscribers),
+                "classes": len(poller.state or {}),
+                "polls": poller.polls,
+                "errors": poller.errors,
+                "last_poll_at": poller.last_poll_at,
+            }
+            for poller in _POLLERS.values()
+        ],
+    }
@@ -1,14 +1,40 @@
 import os
 import time
+import itertools
+import threading
 import requests
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from cache import CACHE_TTL, cache_get, cache_set, cache_keys, cache_invalidate, is_cacheable
+from deadlines import (
+    DeadlineExceeded,
+    upstream_timeout,
+    deadline_exceeded_from_timeout,
+    record_partial,
+    submit_with_context,
+)
+from hedging import HEDGE_ENABLED, hedged_request
+from negative_cache import negative_get, negative_set, negative_allow
+from quota import check_budget, count_call
+from tracing import span, KIND_CLIENT
+
 load_dotenv()
 
 API_KEY = os.getenv("MINDBODY_API_KEY")
 SITE_ID = os.getenv("MINDBODY_SITE_ID")
 BASE_URL = os.getenv("MINDBODY_BASE_URL")
 
+# Called as listener(data, start_date, end_date) after every fresh schedule fetch
+SCHEDULE_LISTENERS = []
+
+# Max concurrent upstream calls for a single bulk booking/cancel request
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "8"))
+
+# Max concurrent date-range shard fetches, shared by every caller in the process
+SHARD_MAX_CONCURRENCY = int(os.getenv("SHARD_MAX_CONCURRENCY", "6"))
+
 # -------------------------
 # INTERNAL TOKEN STORAGE
 # -------------------------
@@ -34,7 +60,12 @@ def issue_user_token(username: str, password: str):
         "Content-Type": "application/json"
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    check_budget()
+    count_call("POST", "/usertoken/issue")
+    try:
+        response = requests.post(url, headers=headers, json=payload, timeout=upstream_timeout())
+    except requests.Timeout as e:
+        raise deadline_exceeded_from_timeout(e)
     data = response.json()
 
     if "AccessToken" in data:
@@ -51,52 +82,136 @@ def issue_user_token(username: str, password: str):
 def ensure_token():
     global USER_TOKEN, TOKEN_EXPIRY
 
-    # still valid
-    if USER_TOKEN and time.time() < TOKEN_EXPIRY:
-        return USER_TOKEN
+    with span("mindbody.ensure_token") as token_span:
+        # still valid
+        if USER_TOKEN and time.time() < TOKEN_EXPIRY:
+            token_span.set_attribute("token.refreshed", False)
+            return USER_TOKEN
 
-    # expired — reissue using default sandbox credentials
-    username = "mindbodysandbox99@gmail.com"
-    password = "Apitest1234"
+        # expired — reissue using default sandbox credentials
+        username = "mindbodysandbox99@gmail.com"
+        password = "Apitest1234"
 
-    print("🔄 Refreshing MINDBODY Staff Token...")
-    data = issue_user_token(username, password)
+        print("🔄 Refreshing MINDBODY Staff Token...")
+        token_span.set_attribute("token.refreshed", True)
+        data = issue_user_token(username, password)
 
-    if "AccessToken" not in data:
-        raise Exception("Failed to refresh MINDBODY user token")
+        if "AccessToken" not in data:
+            raise Exception("Failed to refresh MINDBODY user token")
 
-    return USER_TOKEN
+        return USER_TOKEN
 
 
 # ============================================================
 # 3) UNIVERSAL REQUEST HANDLER
 # ============================================================
-def mb_request(method, endpoint, params=None, body=None, require_auth=False):
-    url = f"{BASE_URL}{endpoint}"
-
-    headers = {
-        "Api-Key": API_KEY,
-        "SiteId": SITE_ID,
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-    }
+def mb_request(method, endpoint, params=None, body=None, require_auth=False, hedge=None):
+    """
+    Call a Mindbody endpoint and return the decoded JSON.
+    hedge: race a second GET if the first is slow (defaults to MINDBODY_HEDGE_ENABLED).
+    """
+    with span("mindbody.request", KIND_CLIENT, **{"http.method": method, "mindbody.endpoint": endpoint}):
+        check_budget()
+        url = f"{BASE_URL}{endpoint}"
+
+        headers = {
+            "Api-Key": API_KEY,
+            "SiteId": SITE_ID,
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+
+        if require_auth:
+            token = ensure_token()
+            headers["Authorization"] = f"Bearer {token}"
+
+        attempt_numbers = itertools.count(1)
+
+        def send():
+            with span("mindbody.attempt", KIND_CLIENT, attempt=next(attempt_numbers)) as attempt_span:
+                # Every attempt (including hedges) is billed upstream
+                count_call(method, endpoint, params, body)
+                response = requests.request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    params=params,
+                    json=body,
+                    timeout=upstream_timeout()
+                )
+                attempt_span.set_attribute("http.status_code", response.status_code)
+                return response
+
+        if hedge is None:
+            hedge = HEDGE_ENABLED
+
+        try:
+            if hedge and method == "GET":
+                response = hedged_request(endpoint, send)
+            else:
+                response = send()
+        except requests.Timeout as e:
+            raise deadline_exceeded_from_timeout(e)
+
+        with span("mindbody.json_decode", **{"http.response_bytes": len(response.content)}):
+            try:
+                return response.json()
+            except:
+                return {"raw": response.text}
 
-    if require_auth:
-        token = ensure_token()
-        headers["Authorization"] = f"Bearer {token}"
 
-    response = requests.request(
-        method=method,
-        url=url,
-        headers=headers,
-        params=params,
-        json=body
-    )
-
-    try:
-        return response.json()
-    except:
-        return {"raw": response.text}
+# ============================================================
+# 3b) CACHE INVALIDATION AFTER OUR OWN WRITES
+# ============================================================
+def _invalidate_client(client_id):
+    if client_id is not None:
+        cache_invalidate("client", str(client_id))
+
+
+# class id -> its day (YYYY-MM-DD), from every schedule this process stored or served
+_CLASS_DAYS = {}
+# schedule cache key -> when its classes were last noted in _CLASS_DAYS
+_NOTED_SCHEDULES = {}
+_CLASS_DAYS_LOCK = threading.Lock()
+
+
+def _note_class_days(key, data, fresh=False):
+    """Remember each class's day so a booking can find the schedules covering it."""
+    now = time.time()
+    with _CLASS_DAYS_LOCK:
+        if not fresh and now - _NOTED_SCHEDULES.get(key, 0) < CACHE_TTL["class_schedule"]:
+            return
+        _NOTED_SCHEDULES[key] = now
+        for cls in data.get("Classes") or []:
+            if cls.get("Id") is not None and cls.get("StartDateTime"):
+                _CLASS_DAYS[cls["Id"]] = str(cls["StartDateTime"])[:10]
+        # Nobody books yesterday's classes; keep the maps to the live schedule
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        for class_id in [cid for cid, day in _CLASS_DAYS.items() if day < yesterday]:
+            del _CLASS_DAYS[class_id]
+        for noted in [k for k, at in _NOTED_SCHEDULES.items() if now - at >= CACHE_TTL["class_schedule"]]:
+            del _NOTED_SCHEDULES[noted]
+
+
+def _covers(key, day):
+    start, end = key
+    return (not start or str(start)[:10] <= day) and (not end or day <= str(end)[:10])
+
+
+def _invalidate_class(class_id):
+    """
+    Drop the cached schedules whose date range covers the class (its booked
+    counts changed). Matches on cache keys only; no cached value is loaded.
+    If this process never saw the class, the whole namespace is dropped.
+    """
+    with _CLASS_DAYS_LOCK:
+        day = _CLASS_DAYS.get(class_id)
+    if day is None:
+        cache_invalidate("class_schedule")
+        return
+    for key in cache_keys("class_schedule"):
+        if _covers(key, day):
+            cache_invalidate("class_schedule", key)
 
 
 # ============================================================
@@ -104,48 +219,99 @@ def mb_request(method, endpoint, params=None, body=None, require_auth=False):
 # ============================================================
 def add_client(client_data: dict):
     """Add a new client (requires auth token)."""
-    return mb_request(
+    data = mb_request(
         method="POST",
         endpoint="/client/addclient",
         body=client_data,
         require_auth=True
     )
+    if isinstance(data, dict) and isinstance(data.get("Client"), dict):
+        negative_allow(data["Client"].get("Id"))
+        _invalidate_client(data["Client"].get("Id"))
+    return data
 
 
-def get_client_info(client_id: str):
-    """Get client complete info."""
-    return mb_request(
+def get_client_info(client_id: str, use_cache: bool = True):
+    """Get client complete info (cached; kept fresh by webhooks)."""
+    if use_cache:
+        cached = cache_get("client", client_id) or negative_get("client", client_id)
+        if cached is not None:
+            return cached
+
+    data = mb_request(
         method="GET",
         endpoint="/client/clientcompleteinfo",
         params={"request.clientId": client_id},
         require_auth=True
     )
+    if not negative_set("client", client_id, data) and is_cacheable(data):
+        cache_set("client", client_id, data)
+    return data
 
 
-def get_client_visits(client_id: str):
-    """Visit/attendance history."""
-    return mb_request(
+def get_client_visits(client_id: str, start_date=None, end_date=None, use_cache: bool = True,
+                      limit=None, offset=0):
+    """Visit/attendance history, optionally limited to a date range (and one page)."""
+    if use_cache:
+        cached = negative_get("visits", client_id, start_date, end_date, limit, offset)
+        if cached is not None:
+            return cached
+
+    params = {
+        "ClientId": client_id,
+        "StartDate": start_date,
+        "EndDate": end_date,
+        "Limit": limit,
+        "Offset": offset if limit is not None else None
+    }
+    data = mb_request(
         method="GET",
         endpoint="/client/clientvisits",
-        params={"ClientId": client_id},
+        params=params,
         require_auth=True
     )
+    negative_set("visits", client_id, data, start_date, end_date, limit, offset)
+    return data
 
 
 # ============================================================
 # 5) CLASS ENDPOINTS
 # ============================================================
-def get_class_schedule(start_date=None, end_date=None):
+def get_class_schedule(start_date=None, end_date=None, use_cache: bool = True, shard=None):
+    """
+    Classes between two dates. shard="day" or "week" fetches the range as
+    concurrent shards (each cached on its own) and merges them by Id.
+    """
+    if shard and start_date and end_date:
+        return _merge_shards(
+            _fetch_shards(date_shards(start_date, end_date, shard),
+                          lambda s, e: get_class_schedule(s, e, use_cache)),
+            "Classes",
+        )
+
+    key = (start_date, end_date)
+    if use_cache:
+        cached = cache_get("class_schedule", key)
+        if cached is not None:
+            _note_class_days(key, cached)
+            return cached
+
     params = {
         "StartDate": start_date,
         "EndDate": end_date
     }
-    return mb_request(
+    data = mb_request(
         method="GET",
         endpoint="/class/classes",
         params=params,
         require_auth=False
     )
+    if is_cacheable(data):
+        _note_class_days(key, data, fresh=True)
+        cache_set("class_schedule", key, data)
+        for listener in SCHEDULE_LISTENERS:
+            listener(data, start_date, end_date)
+    return data
 
 
 def book_class(client_id: str, class_id: int):
@@ -154,24 +320,35 @@ def book_class(client_id: str, class_id: int):
         "ClassId": class_id,
         "Test": False
     }
-    return mb_request(
-        method="POST",
-        endpoint="/class/addclienttoclass",
-        body=body,
-        require_auth=True
-    )
+    try:
+        return mb_request(
+            method="POST",
+            endpoint="/class/addclienttoclass",
+            body=body,
+            require_auth=True
+        )
+    finally:
+        # Invalidate even on errors/timeouts: the booking may have gone through
+        _invalidate_client(client_id)
+        _invalidate_class(class_id)
 
 
 # ============================================================
 # 6) ATTENDANCE ENDPOINTS
 # ============================================================
 def get_attendance_history(client_id: str):
-    return mb_request(
+    cached = negative_get("attendance", client_id)
+    if cached is not None:
+        return cached
+
+    data = mb_request(
         method="GET",
         endpoint="/attendance/getattendancehistory",
         params={"ClientId": client_id},
         require_auth=True
     )
+    negative_set("attendance", client_id, data)
+    return data
 # ============================================================
 # 7) PHASE 1 - NEW CLIENT ENDPOINTS
 # ============================================================
@@ -196,12 +373,15 @@ def update_client(client_id: str, client_data: dict):
         "ClientId": client_id,
         **client_data
     }
-    return mb_request(
-        method="POST",
-        endpoint="/client/updateclient",
-        body=body,
-        require_auth=True
-    )
+    try:
+        return mb_request(
+            method="POST",
+            endpoint="/client/updateclient",
+            body=body,
+            require_auth=True
+        )
+    finally:
+        _invalidate_client(client_id)
 
 
 # ============================================================
@@ -215,12 +395,16 @@ def remove_client_from_class(client_id: str, class_id: int, late_cancel: bool =
         "LateCancel": late_cancel,
         "Test": False
     }
-    return mb_request(
-        method="POST",
-        endpoint="/class/removeclientfromclass",
-        body=body,
-        require_auth=True
-    )
+    try:
+        return mb_request(
+            method="POST",
+            endpoint="/class/removeclientfromclass",
+            body=body,
+            require_auth=True
+        )
+    finally:
+        _invalidate_client(client_id)
+        _invalidate_class(class_id)
 
 
 # ============================================================
@@ -262,7 +446,7 @@ def add_appointment(client_id: str, session_type_id: int, location_id: int, staf
 # ============================================================
 # 10) SALE ENDPOINTS - GET OPERATIONS
 # ============================================================
-def get_services(location_id=None, session_type_id=None, limit=100, offset=0):
+def get_services(location_id=None, session_type_id=None, limit=100, offset=0, use_cache: bool = True):
     """Get available services/class passes."""
     params = {
         "LocationId": location_id,
@@ -270,82 +454,173 @@ def get_services(location_id=None, session_type_id=None, limit=100, offset=0):
         "Limit": limit,
         "Offset": offset
     }
-    return mb_request(
+    key = ("/sale/services", tuple(params.items()))
+    if use_cache:
+        cached = cache_get("catalog", key)
+        if cached is not None:
+            return cached
+
+    data = mb_request(
         method="GET",
         endpoint="/sale/services",
         params=params,
         require_auth=True
     )
+    if is_cacheable(data):
+        cache_set("catalog", key, data)
+    return data
 
 
-def get_contracts(location_id=None, limit=100, offset=0):
+def get_contracts(location_id=None, limit=100, offset=0, use_cache: bool = True):
     """Get available membership contracts."""
     params = {
         "LocationId": location_id,
         "Limit": limit,
         "Offset": offset
     }
-    return mb_request(
+    key = ("/sale/contracts", tuple(params.items()))
+    if use_cache:
+        cached = cache_get("catalog", key)
+        if cached is not None:
+            return cached
+
+    data = mb_request(
         method="GET",
         endpoint="/sale/contracts",
         params=params,
         require_auth=True
     )
+    if is_cacheable(data):
+        cache_set("catalog", key, data)
+    return data
 
 
-def get_products(location_id=None, limit=100, offset=0):
+def get_products(location_id=None, limit=100, offset=0, use_cache: bool = True):
     """Get retail products."""
     params = {
         "LocationId": location_id,
         "Limit": limit,
         "Offset": offset
     }
-    return mb_request(
+    key = ("/sale/products", tuple(params.items()))
+    if use_cache:
+        cached = cache_get("catalog", key)
+        if cached is not None:
+            return cached
+
+    data = mb_request(
         method="GET",
         endpoint="/sale/products",
         params=params,
         require_auth=True
     )
+    if is_cacheable(data):
+        cache_set("catalog", key, data)
+    return data
 
 
-def get_packages(location_id=None, limit=100, offset=0):
+def get_packages(location_id=None, limit=100, offset=0, use_cache: bool = True):
     """Get service packages."""
     params = {
         "LocationId": location_id,
         "Limit": limit,
         "Offset": offset
     }
-    return mb_request(
+    key = ("/sale/packages", tuple(params.items()))
+    if use_cache:
+        cached = cache_get("catalog", key)
+        if cached is not None:
+            return cached
+
+    data = mb_request(
         method="GET",
         endpoint="/sale/packages",
         params=params,
         require_auth=True
     )
+    if is_cacheable(data):
+        cache_set("catalog", key, data)
+    return data
+
 
+def get_sales(start_date=None, end_date=None, limit=100, offset=0, use_cache: bool = True, shard=None):
+    """
+    Get sales/transaction history. With shard="day" or "week" every shard
+    is fetched in full concurrently, merged by Id, then limit/offset applied.
+    """
+    if shard and start_date and end_date:
+        merged = _merge_shards(
+            _fetch_shards(date_shards(start_date, end_date, shard),
+                          lambda s, e: get_all_sales(s, e, use_cache)),
+            "Sales",
+        )
+        if "Sales" not in merged:
+            return merged
+        page = merged["Sales"][offset:offset + limit]
+        return {
+            "PaginationResponse": {
+                "RequestedLimit": limit,
+                "RequestedOffset": offset,
+                "PageSize": len(page),
+                "TotalResults": len(merged["Sales"]),
+            },
+            "Sales": page,
+        }
+
+    key = (start_date, end_date, limit, offset)
+    if use_cache:
+        cached = cache_get("sales", key)
+        if cached is not None:
+            return cached
 
-def get_sales(start_date=None, end_date=None, limit=100, offset=0):
-    """Get sales/transaction history."""
     params = {
         "StartDate": start_date,
         "EndDate": end_date,
         "Limit": limit,
         "Offset": offset
     }
-    return mb_request(
+    data = mb_request(
         method="GET",
         endpoint="/sale/sales",
         params=params,
         require_auth=True
     )
+    if is_cacheable(data):
+        cache_set("sales", key, data)
+    return data
+
+
+def get_all_sales(start_date, end_date, use_cache: bool = True):
+    """Every sale in a range, paged through SHARD_PAGE_SIZE at a time."""
+    sales, offset = [], 0
+    while True:
+        data = get_sales(start_date, end_date, SHARD_PAGE_SIZE, offset, use_cache)
+        if not isinstance(data, dict) or "Sales" not in data:
+            return data
+        page = data["Sales"] or []
+        sales.extend(page)
+        total = (data.get("PaginationResponse") or {}).get("TotalResults")
+        offset += len(page)
+        if len(page) < SHARD_PAGE_SIZE or (total is not None and offset >= total):
+            return {"PaginationResponse": {"TotalResults": len(sales)}, "Sales": sales}
 
 
-def get_accepted_card_types():
+def get_accepted_card_types(use_cache: bool = True):
     """Get accepted payment card types."""
-    return mb_request(
+    if use_cache:
+        cached = cache_get("catalog", "/sale/acceptedcardtypes")
+        if cached is not None:
+            return cached
+
+    data = mb_request(
         method="GET",
         endpoint="/sale/acceptedcardtypes",
         require_auth=True
     )
+    # Mindbody answers with a bare list of card type names
+    if isinstance(data, list) or is_cacheable(data):
+        cache_set("catalog", "/sale/acceptedcardtypes", data)
+    return data
 
 
 # ============================================================
@@ -380,4 +655,170 @@ def checkout_shopping_cart(client_id: str, items: list, payment_info: dict, test
         endpoint="/sale/checkoutshoppingcart",
         body=body,
         require_auth=True
-    )
\ No newline at end of file
+    )
+
+
+# ============================================================
+# 12) BULK CLASS OPERATIONS (concurrent fan-out)
+# ============================================================
+def _is_class_full(result):
+    """Mindbody reports a full class as an Error whose code/message says so."""
+    error = result.get("Error") if isinstance(result, dict) else None
+    if not isinstance(error, dict):
+        return False
+    text = f"{error.get('Code', '')} {error.get('Message', '')}".lower()
+    return "full" in text
+
+
+def _run_bulk(pairs, operation, success_status, stop_on_full):
+    """
+    Run operation(client_id, class_id) for each pair under a bounded pool.
+    Once a class reports full, queued pairs for that class are skipped.
+    Returns per-pair outcomes in input order plus a status summary.
+    """
+    full_classes = set()
+
+    def run_one(client_id, class_id):
+        if class_id in full_classes:
+            return {"status": "skipped", "reason": "class full"}
+        try:
+            result = operation(client_id, class_id)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+        if stop_on_full and _is_class_full(result):
+            full_classes.add(class_id)
+            return {"status": "class_full", "response": result}
+        if isinstance(result, dict) and ("Error" in result or "raw" in result):
+            return {"status": "failed", "response": result}
+        return {"status": success_status, "response": result}
+
+    futures = []
+    if pairs:
+        workers = min(BULK_MAX_CONCURRENCY, len(pairs))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                submit_with_context(pool, run_one, client_id, class_id)
+                for client_id, class_id in pairs
+            ]
+
+    outcomes = []
+    record_partial("results", outcomes)
+    deadline_error = None
+    for (client_id, class_id), future in zip(pairs, futures):
+        try:
+            outcome = future.result()
+        except DeadlineExceeded as e:
+            deadline_error = e
+            outcome = {"status": "deadline_exceeded"}
+        outcomes.append({"client_id": client_id, "class_id": class_id, **outcome})
+
+    # Surfaces as a 504 whose body carries the outcomes recorded above
+    if deadline_error is not None:
+        raise deadline_error
+
+    summary = {}
+    for outcome in outcomes:
+        summary[outcome["status"]] = summary.get(outcome["status"], 0) + 1
+
+    return {"total": len(outcomes), "summary": summary, "results": outcomes}
+
+
+def bulk_book_class(pairs: list):
+    """Book many (client_id, class_id) pairs concurrently."""
+    return _run_bulk(pairs, book_class, "booked", stop_on_full=True)
+
+
+def bulk_remove_clients_from_class(pairs: list, late_cancel: bool = False):
+    """Cancel many (client_id, class_id) bookings concurrently."""
+    def cancel(client_id, class_id):
+        return remove_client_from_class(client_id, class_id, late_cancel)
+    return _run_bulk(pairs, cancel, "cancelled", stop_on_full=False)
+
+
+# ============================================================
+# 13) DATE-RANGE SHARDING (concurrent wide-range reads)
+# ============================================================
+SHARD_DAYS = {"day": 1, "week": 7}
+SHARD_PAGE_SIZE = 200
+_SHARD_SLOTS = threading.BoundedSemaphore(SHARD_MAX_CONCURRENCY)
+
+
+def date_shards(start_date: str, end_date: str, shard: str):
+    """Split an inclusive YYYY-MM-DD range into consecutive (start, end) shards."""
+    step = SHARD_DAYS[shard]
+    start, end = date.fromisoformat(start_date[:10]), date.fromisoformat(end_date[:10])
+    shards = []
+    while start <= end:
+        shard_end = min(start + timedelta(days=step - 1), end)
+        shards.append((start.isoformat(), shard_end.isoformat()))
+        start = shard_end + timedelta(days=1)
+    return shards
+
+
+def _fetch_shards(shards, fetch, ordered=True):
+    """
+    Yield (shard_start, shard_end, data) for fetch(start, end) over every shard,
+    in shard order or (ordered=False) as each finishes. Fetches run concurrently
+    but never more than SHARD_MAX_CONCURRENCY at once across the process.
+    """
+    def run(shard_start, shard_end):
+        with _SHARD_SLOTS:
+            return fetch(shard_start, shard_end)
+
+    if len(shards) <= 1:
+        for shard_start, shard_end in shards:
+            yield shard_start, shard_end, fetch(shard_start, shard_end)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(SHARD_MAX_CONCURRENCY, len(shards))) as pool:
+        futures = {submit_with_context(pool, run, *bounds): bounds for bounds in shards}
+        for future in (futures if ordered else as_completed(futures)):
+            yield (*futures[future], future.result())
+
+
+def _dedup_shards(results, list_key):
+    """Drop records (by Id) already yielded by an earlier shard."""
+    seen = set()
+    for shard_start, shard_end, data in results:
+        if isinstance(data, dict) and list_key in data:
+            fresh = []
+            for item in data[list_key] or []:
+                item_id = item.get("Id") if isinstance(item, dict) else None
+                if item_id is None or item_id not in seen:
+                    fresh.append(item)
+                    if item_id is not None:
+                        seen.add(item_id)
+            data = {**data, list_key: fresh}
+        yield shard_start, shard_end, data
+
+
+def _merge_shards(results, list_key):
+    """One Mindbody-shaped response from ordered shards; the first failing shard wins."""
+    merged = []
+    for shard_start, shard_end, data in _dedup_shards(results, list_key):
+        if not isinstance(data, dict) or list_key not in data:
+            error = data if isinstance(data, dict) else {"Error": str(data)}
+            return {**error, "Shard": [shard_start, shard_end]}
+        merged.extend(data[list_key])
+    return {"PaginationResponse": {"TotalResults": len(merged)}, list_key: merged}
+
+
+def iter_class_schedule(start_date: str, end_date: str, shard: str = "day", use_cache: bool = True):
+    """Yield (shard_start, shard_end, data) as each schedule shard finishes."""
+    return _dedup_shards(
+        _fetch_shards(date_shards(start_date, end_date, shard),
+                      lambda s, e: get_class_schedule(s, e, use_cache), ordered=False),
+        "Classes",
+    )
+
+
+def iter_sales(start_date: str, end_date: str, shard: str = "week", use_cache: bool = True):
+    """Yield (shard_start, shard_end, data) with every sale of each shard as it finishes."""
+    return _dedup_shards(
+        _fetch_shards(date_shards(start_date, end_date, shard),
+                      lambda s, e: get_all_sales(s, e, use_cache), ordered=False),
+        "Sales",
+    )
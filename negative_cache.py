@@ -0,0 +1,181 @@
+"""
+Negative cache for client lookups that found nothing.
+
+Unknown client IDs (bots, stale links) and empty visit/attendance lookups
+are remembered for NEGATIVE_CACHE_TTL seconds so repeats are answered
+without an authenticated upstream call. Membership is kept in Bloom filters
+of fixed size, so a flood of random IDs cannot grow memory; TTL comes from
+rotating generations (a new filter every TTL / (generations - 1)); every
+filter started more than TTL ago is dropped on each call, however long the
+cache sat idle, so an entry lives between TTL - TTL / (generations - 1) and
+TTL. Bloom filters cannot delete, so IDs that become valid (add_client,
+client.created webhooks, new bookings) go into a small allow-set that
+overrides the filters for a full TTL, the longest a filter can live.
+
+Client lookups count as negative only on a "no such client" error; a
+client record is never negative however empty its lists are. Hits are
+answered with a generic body built for the requested ID, never with
+another client's response.
+
+A Bloom false positive would hide a real client, so size the filter
+(NEGATIVE_CACHE_BITS) well above the expected unknown-ID rate per TTL.
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "120"))
+NEGATIVE_CACHE_BITS = int(os.getenv("NEGATIVE_CACHE_BITS", str(1 << 20)))
+NEGATIVE_CACHE_HASHES = int(os.getenv("NEGATIVE_CACHE_HASHES", "7"))
+NEGATIVE_CACHE_GENERATIONS = int(os.getenv("NEGATIVE_CACHE_GENERATIONS", "4"))
+
+# Mindbody error codes / messages that mean "no such client"
+NOT_FOUND_CODES = {"ClientNotFound", "InvalidClientId", "NotFound"}
+_NOT_FOUND_MESSAGE = re.compile(r"not found|does not exist|invalid client", re.IGNORECASE)
+
+_LOCK = threading.Lock()
+
+
+class BloomFilter:
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+
+    @property
+    def nbytes(self):
+        return len(self._array)
+
+    def __contains__(self, key):
+        return all(self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+# ============================================================
+# 1) STATE
+# ============================================================
+_ROTATE_EVERY = NEGATIVE_CACHE_TTL / max(NEGATIVE_CACHE_GENERATIONS - 1, 1)
+_GENERATIONS = []            # newest last: (started_at, BloomFilter)
+_ALLOWED = {}                # client id -> allowed until
+_EMPTY_KEYS = {}             # kind -> list keys of its last empty (but valid) result
+NEGATIVE_CACHE_STATS = {"hits": 0, "misses": 0, "stored": 0, "allowed": 0}
+
+
+def _rotate(now):
+    """Drop generations started TTL or more ago; start a new one every _ROTATE_EVERY."""
+    expired = sum(1 for started_at, _ in _GENERATIONS if now - started_at >= NEGATIVE_CACHE_TTL)
+    if expired:
+        del _GENERATIONS[:expired]
+    if not _GENERATIONS or now - _GENERATIONS[-1][0] >= _ROTATE_EVERY:
+        _GENERATIONS.append((now, BloomFilter(NEGATIVE_CACHE_BITS, NEGATIVE_CACHE_HASHES)))
+        del _GENERATIONS[:-NEGATIVE_CACHE_GENERATIONS]
+    for client_id in [cid for cid, until in _ALLOWED.items() if until <= now]:
+        del _ALLOWED[client_id]
+
+
+def _key(kind, client_id, extra):
+    return "|".join([kind, str(client_id), *(str(x) for x in extra)])
+
+
+# ============================================================
+# 2) CLASSIFY / LOOKUP / STORE
+# ============================================================
+NOT_FOUND, EMPTY = "not_found", "empty"
+
+
+def is_not_found(data):
+    """True for a Mindbody "no such client" error."""
+    error = data.get("Error") if isinstance(data, dict) else None
+    if not isinstance(error, dict):
+        return False
+    return error.get("Code") in NOT_FOUND_CODES or \
+        bool(_NOT_FOUND_MESSAGE.search(str(error.get("Message") or "")))
+
+
+def classify(kind, data):
+    """NOT_FOUND, EMPTY (valid result, only empty lists) or None when not negative."""
+    if is_not_found(data):
+        return NOT_FOUND
+    if kind == "client" or not isinstance(data, dict) or "Error" in data or data.get("Client"):
+        return None
+    lists = [v for v in data.values() if isinstance(v, list)]
+    return EMPTY if lists and not any(lists) else None
+
+
+def _body(kind, client_id, outcome):
+    """Generic negative body for this ID; carries nothing from other lookups."""
+    if outcome == NOT_FOUND:
+        return {"Error": {"Code": "ClientNotFound", "Message": f"Client {client_id} not found."}}
+    return {key: [] for key in _EMPTY_KEYS.get(kind, ())}
+
+
+def negative_get(kind, client_id, *extra):
+    """Generic negative body for this lookup, or None to go upstream."""
+    if NEGATIVE_CACHE_TTL <= 0:
+        return None
+    key = _key(kind, client_id, extra)
+    now = time.time()
+    with _LOCK:
+        _rotate(now)
+        outcome = None
+        if _ALLOWED.get(str(client_id), 0) <= now:
+            for candidate in (NOT_FOUND, EMPTY):
+                if candidate == EMPTY and kind not in _EMPTY_KEYS:
+                    continue
+                if any(f"{key}|{candidate}" in bloom for _, bloom in _GENERATIONS):
+                    outcome = candidate
+                    break
+        NEGATIVE_CACHE_STATS["hits" if outcome else "misses"] += 1
+        if outcome is None:
+            return None
+        return _body(kind, client_id, outcome)
+
+
+def negative_set(kind, client_id, data, *extra):
+    """Remember a negative upstream result; returns True if it was stored."""
+    outcome = classify(kind, data) if NEGATIVE_CACHE_TTL > 0 else None
+    if outcome is None:
+        return False
+    key = _key(kind, client_id, extra)
+    with _LOCK:
+        if _ALLOWED.get(str(client_id), 0) > time.time():
+            return False
+        _rotate(time.time())
+        _GENERATIONS[-1][1].add(f"{key}|{outcome}")
+        if outcome == EMPTY:
+            _EMPTY_KEYS[kind] = tuple(k for k, v in data.items() if isinstance(v, list))
+        NEGATIVE_CACHE_STATS["stored"] += 1
+    return True
+
+
+def negative_allow(client_id):
+    """A client now exists (or has new visits): bypass any negative entry."""
+    if client_id is None:
+        return
+    with _LOCK:
+        # every filter holding this ID was started before now, so it is gone by now + TTL
+        _ALLOWED[str(client_id)] = time.time() + NEGATIVE_CACHE_TTL
+        NEGATIVE_CACHE_STATS["allowed"] += 1
+
+
+def negative_cache_stats():
+    with _LOCK:
+        return {
+            **NEGATIVE_CACHE_STATS,
+            "ttl_seconds": NEGATIVE_CACHE_TTL,
+            "generations": len(_GENERATIONS),
+            "bytes": sum(bloom.nbytes for _, bloom in _GENERATIONS),
+            "allow_set": len(_ALLOWED),
+        }
@@ -0,0 +1,308 @@
+"""
+Durable write outbox for Mindbody write operations.
+
+Routes called with ?async=true store the operation in a local SQLite outbox
+(MINDBODY_DATA_DIR/outbox.db) and return 202 with an operation ID right
+away. A pool of worker threads drains the outbox:
+
+- operations for the same client run strictly in submission order
+- failures where the request never reached Mindbody (connect errors, token
+  refresh, quota) are retried with exponential backoff up to
+  OUTBOX_MAX_ATTEMPTS; Mindbody "Error" responses fail immediately
+- add_client, book_class and add_appointment are not idempotent: after a
+  read timeout, dropped connection or non-JSON answer the write may already
+  have been applied, so they are not blindly retried. add_client first looks
+  the client up by email; the others fail with an "outcome unknown" error
+- claims are leases, so work held by a worker that died is picked up again
+  once the lease expires (also across processes sharing the file); that
+  counts as an unknown outcome too
+
+GET /operations/{id} reports the outcome.
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from mindbody_client import add_client, update_client, book_class, add_appointment, ensure_token, get_clients
+from quota import QuotaExceeded, set_caller
+
+DATA_DIR = os.getenv("MINDBODY_DATA_DIR", "data")
+OUTBOX_DB = os.path.join(DATA_DIR, "outbox.db")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+OUTBOX_MAX_BACKOFF = 300
+
+# kind -> function(**payload)
+OPERATIONS = {
+    "add_client": add_client,
+    "update_client": update_client,
+    "book_class": book_class,
+    "add_appointment": add_appointment,
+}
+
+# Safe to send twice: the second call leaves Mindbody in the same state
+IDEMPOTENT_KINDS = {"update_client"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    order_key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS operations_claim ON operations (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS operations_order ON operations (order_key, seq);
+"""
+
+_WAKE = threading.Event()
+
+
+class RetryableError(Exception):
+    pass
+
+
+class NotSentError(Exception):
+    """Failed before the write was sent (token refresh); always safe to retry."""
+
+
+# ============================================================
+# 1) STORE
+# ============================================================
+def _connect():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def enqueue(kind: str, payload: dict, order_key: str = None):
+    """Persist an operation and return its ID (durable once this returns)."""
+    if kind not in OPERATIONS:
+        raise ValueError(f"Unknown outbox operation: {kind}")
+    operation_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO operations (id, kind, order_key, payload, status, created_at, updated_at, next_attempt_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+            (operation_id, kind, order_key, json.dumps(payload), now, now, now),
+        )
+    finally:
+        conn.close()
+    _WAKE.set()
+    return operation_id
+
+
+def get_operation(operation_id: str):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM operations WHERE id = ?", (operation_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        "operation_id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "next_attempt_at": row["next_attempt_at"] if row["status"] == "pending" else None,
+    }
+
+
+def outbox_stats():
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM operations GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    return {row["status"]: row["n"] for row in rows}
+
+
+# ============================================================
+# 2) CLAIM + EXECUTE
+# ============================================================
+_CLAIM_SQL = """
+SELECT * FROM operations AS o
+WHERE ((o.status = 'pending' AND o.next_attempt_at <= :now)
+       OR (o.status = 'in_progress' AND o.lease_until < :now))
+  AND NOT EXISTS (
+      SELECT 1 FROM operations AS p
+      WHERE p.order_key = o.order_key AND p.seq < o.seq
+        AND p.status IN ('pending', 'in_progress'))
+ORDER BY o.seq
+LIMIT 1
+"""
+
+
+def _claim(conn):
+    """Lease the oldest runnable operation whose client has nothing earlier outstanding."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(_CLAIM_SQL, {"now": now}).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE operations SET status = 'in_progress', lease_until = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE seq = ?",
+                (now + OUTBOX_LEASE_SECONDS, now, row["seq"]),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def _execute(row):
+    try:
+        ensure_token()
+    except Exception as e:
+        raise NotSentError(f"Token refresh failed: {e}")
+    result = OPERATIONS[row["kind"]](**json.loads(row["payload"]))
+    if isinstance(result, dict) and "raw" in result:
+        raise RetryableError(f"Non-JSON upstream response: {str(result['raw'])[:200]}")
+    return result
+
+
+def _not_sent(error):
+    """True if the write never reached Mindbody, so sending it again cannot duplicate it."""
+    if isinstance(error, (NotSentError, QuotaExceeded, requests.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def _find_added_client(payload):
+    """The client an earlier add_client attempt created, looked up by email; None if absent."""
+    email = ((payload.get("client_data") or {}).get("Email") or "").strip().lower()
+    data = get_clients(search_text=email, limit=10)
+    if not isinstance(data, dict) or "Clients" not in data:
+        raise RetryableError(f"Could not check for an existing client: {data}")
+    for client in data["Clients"] or []:
+        if (client.get("Email") or "").strip().lower() == email:
+            return {"Client": client, "Reconciled": True}
+    return None
+
+
+def _can_reconcile(row):
+    if row["kind"] == "add_client":
+        return bool((json.loads(row["payload"]).get("client_data") or {}).get("Email"))
+    return False
+
+
+def _reconcile_or_fail(conn, row, cause):
+    """
+    After an attempt whose outcome is unknown: the earlier result if the write
+    went through, None if it did not (safe to send again), or False once the
+    operation has been failed because that cannot be told.
+    """
+    if _can_reconcile(row):
+        try:
+            return _find_added_client(json.loads(row["payload"]))
+        except Exception as e:
+            cause = f"{cause}; lookup failed: {e}"
+    _finish(conn, row, "failed",
+            error=f"Outcome unknown ({cause}); not retried so the write cannot be applied twice")
+    return False
+
+
+def _finish(conn, row, status, result=None, error=None, retry_in=None):
+    now = time.time()
+    conn.execute(
+        "UPDATE operations SET status = ?, result = ?, error = ?, updated_at = ?, "
+        "next_attempt_at = ?, lease_until = NULL WHERE seq = ?",
+        (status, json.dumps(result) if result is not None else None, error, now,
+         now + (retry_in or 0), row["seq"]),
+    )
+
+
+def process_one(conn):
+    """Run one operation; returns False when nothing is runnable."""
+    row = _claim(conn)
+    if row is None:
+        return False
+
+    attempts = row["attempts"] + 1
+    # Pending rows only come back after a failure that was safe to retry;
+    # an expired lease means a worker died mid-call with the outcome unknown
+    unknown = row["status"] == "in_progress" and row["kind"] not in IDEMPOTENT_KINDS
+    try:
+        result = None
+        if unknown:
+            result = _reconcile_or_fail(conn, row, "a worker stopped mid-call")
+            if result is False:
+                return True
+        if result is None:
+            result = _execute(row)
+    except Exception as e:
+        if not _not_sent(e) and row["kind"] not in IDEMPOTENT_KINDS:
+            result = _reconcile_or_fail(conn, row, e)
+            if result is False:
+                return True
+            if result is not None:
+                _finish(conn, row, "succeeded", result=result)
+                return True
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            _finish(conn, row, "failed", error=f"Gave up after {attempts} attempts: {e}")
+        else:
+            backoff = min(2 ** attempts, OUTBOX_MAX_BACKOFF) * random.uniform(0.5, 1.0)
+            _finish(conn, row, "pending", error=str(e), retry_in=backoff)
+        return True
+
+    if isinstance(result, dict) and "Error" in result:
+        _finish(conn, row, "failed", result=result, error=str(result["Error"]))
+    else:
+        _finish(conn, row, "succeeded", result=result)
+    return True
+
+
+def _worker(stop_event):
+    set_caller("job:outbox")
+    conn = _connect()
+    try:
+        while not stop_event.is_set():
+            try:
+                if process_one(conn):
+                    continue
+            except sqlite3.Error as e:
+                print(f"❌ Outbox worker error: {e}")
+            _WAKE.wait(OUTBOX_POLL_SECONDS)
+            _WAKE.clear()
+    finally:
+        conn.close()
+
+
+def start_outbox_workers():
+    """Start the worker pool; returns a stop event."""
+    stop_event = threading.Event()
+    for i in range(OUTBOX_WORKERS):
+        threading.Thread(target=_worker, args=(stop_event,), name=f"outbox-{i}", daemon=True).start()
+    return stop_event
@@ -0,0 +1,214 @@
+"""
+On-demand per-request profiling.
+
+A request is profiled when it carries `X-Profile: 1` plus a valid
+X-Admin-Token, or when an admin has turned on sampling
+(POST /admin/profiling?sample_rate=0.05). The route handler (which runs
+mb_request, JSON decoding and the response encoding) is run under cProfile
+in its own worker thread; the result is stored as a .prof file under
+MINDBODY_DATA_DIR/profiles for download, and can be aggregated into
+hot-function stats over a time window.
+
+Only one request is profiled at a time: cProfile cannot run two profilers
+at once on Python 3.12+ (sys.monitoring is interpreter-wide), so a marked
+request that arrives while another is being profiled runs unprofiled and
+gets X-Profile-Skipped instead of X-Profile-Id. On 3.12+ a profile also
+includes whatever other threads ran while it was active. Async routes are
+never profiled (X-Profile-Skipped): their handler runs on the event-loop
+thread, so the profile would record every other request's coroutines too.
+
+With profiling off, every request still pays for the profile_marked_requests
+middleware in app.py (one more BaseHTTPMiddleware hop plus the X-Profile /
+sample-rate check) and a context-variable read in the route wrapper; the
+route-path lookup only runs for requests that are profiled.
+"""
+
+import os
+import hmac
+import time
+import uuid
+import pstats
+import random
+import cProfile
+import asyncio
+import functools
+import threading
+import contextvars
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_DIR = os.path.join(os.getenv("MINDBODY_DATA_DIR", "data"), "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+PROFILING_STATE = {"sample_rate": 0.0, "enabled_at": None}
+
+_PROFILE_REQUEST = contextvars.ContextVar("mindbody_profile_request", default=None)
+_LOCK = threading.Lock()
+_ACTIVE = threading.Lock()   # held while a profiler is enabled
+_PROFILES = []   # newest last: {"id", "route", "path", "started_at", "duration_ms"}
+
+
+# ============================================================
+# 1) AUTH + PER-REQUEST DECISION
+# ============================================================
+def is_admin(token):
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def should_profile(headers, path):
+    """Explicit admin opt-in header, or the admin-configured sample rate."""
+    if path.startswith("/admin/"):
+        return False
+    if headers.get("X-Profile") == "1" and is_admin(headers.get("X-Admin-Token")):
+        return True
+    rate = PROFILING_STATE["sample_rate"]
+    return rate > 0 and random.random() < rate
+
+
+def start_profile(route, path):
+    """Mark the current request for profiling; returns (request info, reset token)."""
+    request_info = {"id": uuid.uuid4().hex, "route": route, "path": path}
+    return request_info, _PROFILE_REQUEST.set(request_info)
+
+
+def stop_profile(token):
+    _PROFILE_REQUEST.reset(token)
+
+
+def set_sample_rate(sample_rate: float):
+    PROFILING_STATE["sample_rate"] = max(0.0, min(sample_rate, 1.0))
+    PROFILING_STATE["enabled_at"] = time.time() if sample_rate > 0 else None
+    return dict(PROFILING_STATE)
+
+
+# ============================================================
+# 2) ROUTE WRAPPER
+# ============================================================
+def _store(request_info, profiler, started_at, duration):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{request_info['id']}.prof"))
+    with _LOCK:
+        _PROFILES.append({**request_info, "started_at": started_at,
+                          "duration_ms": round(duration * 1000, 2)})
+        while len(_PROFILES) > PROFILE_MAX_FILES:
+            old = _PROFILES.pop(0)
+            try:
+                os.remove(profile_path(old["id"]))
+            except OSError:
+                pass
+
+
+def _begin(request_info):
+    """Enable a profiler for this request, or None (and mark it skipped) if one is already running."""
+    if not _ACTIVE.acquire(blocking=False):
+        request_info["skipped"] = "another request is being profiled"
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another profiling tool (e.g. a debugger or py-spy hook) owns sys.monitoring
+        _ACTIVE.release()
+        request_info["skipped"] = str(e)
+        return None
+    return profiler
+
+
+def _end(request_info, profiler, started_at, started):
+    profiler.disable()
+    _ACTIVE.release()
+    _store(request_info, profiler, started_at, time.perf_counter() - started)
+
+
+def _run_profiled(request_info, call):
+    started_at, started = time.time(), time.perf_counter()
+    profiler = _begin(request_info)
+    if profiler is None:
+        return call()
+    try:
+        result = call()
+        # Encode inside the profile so pydantic/jsonable_encoder cost shows up
+        if not isinstance(result, Response):
+            result = jsonable_encoder(result)
+        return result
+    finally:
+        _end(request_info, profiler, started_at, started)
+
+
+def profiled(endpoint):
+    """Wrap a route endpoint so a marked request runs under cProfile."""
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            request_info = _PROFILE_REQUEST.get()
+            if request_info is not None:
+                request_info["skipped"] = "async routes are not profiled"
+            return await endpoint(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        request_info = _PROFILE_REQUEST.get()
+        if request_info is None:
+            return endpoint(*args, **kwargs)
+        return _run_profiled(request_info, lambda: endpoint(*args, **kwargs))
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose endpoint can be profiled per request (set as app.router.route_class)."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+
+# ============================================================
+# 3) STORED PROFILES + HOT FUNCTIONS
+# ============================================================
+def profile_path(profile_id):
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+def list_profiles(limit: int = 50):
+    with _LOCK:
+        return list(reversed(_PROFILES[-limit:]))
+
+
+def hot_functions(window_seconds: int = 300, limit: int = 30, sort: str = "tottime"):
+    """Merge every profile from the last window and rank functions."""
+    cutoff = time.time() - window_seconds
+    with _LOCK:
+        ids = [p["id"] for p in _PROFILES if p["started_at"] >= cutoff]
+
+    stats = None
+    for profile_id in ids:
+        path = profile_path(profile_id)
+        if not os.path.exists(path):
+            continue
+        if stats is None:
+            stats = pstats.Stats(path)
+        else:
+            stats.add(path)
+
+    if stats is None:
+        return {"window_seconds": window_seconds, "profiles": 0, "functions": []}
+
+    index = {"calls": 1, "tottime": 2, "cumtime": 3}.get(sort, 2)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][index], reverse=True)[:limit]
+    return {
+        "window_seconds": window_seconds,
+        "profiles": len(ids),
+        "sort": sort,
+        "functions": [
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "tottime": round(tottime, 6),
+                "cumtime": round(cumtime, 6),
+            }
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+        ],
+    }
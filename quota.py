@@ -0,0 +1,440 @@
+"""
+Upstream quota accounting for Mindbody API calls.
+
+Every upstream HTTP call is counted against a caller tag: "route:GET
+/clients/{client_id}" for app.py requests (set by middleware), or
+"job:<name>" / "script:<name>" for background jobs and scripts (set with
+tagged() or set_caller()). Counts are kept per hour and per day in
+MINDBODY_DATA_DIR/quota.db, shared by every worker and script on the host.
+Calls are counted in memory and a background thread flushes them every
+QUOTA_FLUSH_SECONDS (and at exit), so no SQLite work happens on the request
+path; budget checks see other processes' calls as of their last flush.
+
+Budgets come from QUOTA_BUDGETS, e.g.
+    {"route:GET /reports/sales": {"hour": 500, "action": "reject"},
+     "job:visit-rollups": {"day": 20000, "action": "throttle"}}
+Past warn_at (default 0.8) of a budget a warning is logged; past the
+budget itself "warn" keeps logging, "throttle" delays each call by
+QUOTA_THROTTLE_SECONDS and "reject" raises QuotaExceeded (a 429 in app.py).
+
+Each inbound request also records how many upstream calls it made; one
+endpoint called QUOTA_N_PLUS_ONE_THRESHOLD+ times with different
+(non-paging) parameters in one request is flagged as an N+1 pattern.
+Routes whose fan-out is the point (N_PLUS_ONE_EXEMPT, e.g. bulk booking)
+are never flagged.
+"""
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+DATA_DIR = os.getenv("MINDBODY_DATA_DIR", "data")
+QUOTA_DB = os.path.join(DATA_DIR, "quota.db")
+QUOTA_BUDGETS = json.loads(os.getenv("QUOTA_BUDGETS", "{}"))
+QUOTA_WARN_AT = float(os.getenv("QUOTA_WARN_AT", "0.8"))
+QUOTA_THROTTLE_SECONDS = float(os.getenv("QUOTA_THROTTLE_SECONDS", "1"))
+QUOTA_N_PLUS_ONE_THRESHOLD = int(os.getenv("QUOTA_N_PLUS_ONE_THRESHOLD", "5"))
+QUOTA_RETENTION_DAYS = int(os.getenv("QUOTA_RETENTION_DAYS", "90"))
+QUOTA_FLUSH_SECONDS = float(os.getenv("QUOTA_FLUSH_SECONDS", "5"))
+
+UNTAGGED = "untagged"
+# Callers that make one upstream call per item by design; never flagged as N+1
+N_PLUS_ONE_EXEMPT = {
+    "route:POST /classes/book/bulk",
+    "route:POST /classes/cancel/bulk",
+    # Extend with QUOTA_N_PLUS_ONE_EXEMPT='["job:visit-rollups"]'
+    *json.loads(os.getenv("QUOTA_N_PLUS_ONE_EXEMPT", "[]")),
+}
+# Parameters that page or window a query rather than pick a different record
+PAGING_PARAMS = {"Limit", "Offset", "StartDate", "EndDate", "StartDateTime", "EndDateTime"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    bucket TEXT NOT NULL,          -- 'hour' | 'day'
+    period TEXT NOT NULL,          -- 2025-12-03T14 | 2025-12-03
+    caller TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    PRIMARY KEY (bucket, period, caller, endpoint)
+);
+CREATE TABLE IF NOT EXISTS route_requests (
+    day TEXT NOT NULL,
+    caller TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    upstream_calls INTEGER NOT NULL,
+    max_calls INTEGER NOT NULL,
+    PRIMARY KEY (day, caller)
+);
+CREATE TABLE IF NOT EXISTS n_plus_one (
+    at REAL NOT NULL,
+    caller TEXT NOT NULL,
+    path TEXT,
+    endpoint TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    distinct_params INTEGER NOT NULL
+);
+"""
+
+_CALLER = contextvars.ContextVar("mindbody_quota_caller", default=None)
+_REQUEST = contextvars.ContextVar("mindbody_quota_request", default=None)
+_LOCAL = threading.local()
+_WARNED = set()          # (caller, bucket, period, level) already logged
+_LAST_PRUNE = {"hour": None}
+
+# Not yet flushed: (bucket, period, caller, endpoint) -> calls, (day, caller) ->
+# [requests, upstream calls, max calls], and N+1 flag rows
+_PENDING = {"usage": {}, "requests": {}, "flags": []}
+_TOTALS = {}             # (bucket, period, caller) -> host-wide calls as of the last flush
+_UNSEEN = {}             # (bucket, period, caller) -> calls counted here since then
+_PENDING_LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_FLUSHER = {"thread": None}
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, caller, bucket, used, budget, retry_after):
+        super().__init__(f"Upstream call budget for {caller} exhausted ({used}/{budget} this {bucket})")
+        self.caller = caller
+        self.bucket = bucket
+        self.used = used
+        self.budget = budget
+        self.retry_after = retry_after
+
+
+class RequestCalls:
+    """Upstream calls made on behalf of one inbound request (shared with its worker threads)."""
+
+    def __init__(self, caller, path):
+        self.caller = caller
+        self.path = path
+        self.calls = 0
+        self.by_endpoint = {}    # endpoint -> {param signature: calls}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, signature):
+        with self._lock:
+            self.calls += 1
+            signatures = self.by_endpoint.setdefault(endpoint, {})
+            signatures[signature] = signatures.get(signature, 0) + 1
+
+    def n_plus_one(self):
+        if self.caller in N_PLUS_ONE_EXEMPT:
+            return []
+        with self._lock:
+            return [
+                {"endpoint": endpoint, "calls": sum(sigs.values()), "distinct_params": len(sigs)}
+                for endpoint, sigs in self.by_endpoint.items()
+                if len(sigs) >= QUOTA_N_PLUS_ONE_THRESHOLD
+            ]
+
+
+def _conn():
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(QUOTA_DB, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _LOCAL.conn = conn
+    return conn
+
+
+def _periods(now=None):
+    now = datetime.now() if now is None else now
+    return {"hour": now.strftime("%Y-%m-%dT%H"), "day": now.strftime("%Y-%m-%d")}
+
+
+def _seconds_left(bucket, now=None):
+    now = datetime.now() if now is None else now
+    if bucket == "hour":
+        return 3600 - (now.minute * 60 + now.second)
+    return 86400 - (now.hour * 3600 + now.minute * 60 + now.second)
+
+
+# ============================================================
+# 1) TAGGING
+# ============================================================
+def current_caller():
+    return _CALLER.get() or UNTAGGED
+
+
+def set_caller(caller):
+    """Tag the rest of this context (e.g. a script's main); returns a reset token."""
+    return _CALLER.set(caller)
+
+
+@contextmanager
+def tagged(caller):
+    """Attribute upstream calls made inside the block to `caller` (jobs, scripts)."""
+    token = _CALLER.set(caller)
+    try:
+        yield
+    finally:
+        _CALLER.reset(token)
+
+
+def begin_request(caller, path):
+    """Start accounting for an inbound request; returns (RequestCalls, reset tokens)."""
+    calls = RequestCalls(caller, path)
+    return calls, (_CALLER.set(caller), _REQUEST.set(calls))
+
+
+def end_request(tokens):
+    _CALLER.reset(tokens[0])
+    _REQUEST.reset(tokens[1])
+
+
+def record_request(calls):
+    """Queue one finished request's upstream call count and any N+1 flags (no I/O)."""
+    flags = calls.n_plus_one()
+    day = _periods()["day"]
+    with _PENDING_LOCK:
+        entry = _PENDING["requests"].setdefault((day, calls.caller), [0, 0, 0])
+        entry[0] += 1
+        entry[1] += calls.calls
+        entry[2] = max(entry[2], calls.calls)
+        for flag in flags:
+            _PENDING["flags"].append((time.time(), calls.caller, calls.path, flag["endpoint"],
+                                      flag["calls"], flag["distinct_params"]))
+    _ensure_flusher()
+    for flag in flags:
+        print(f"⚠️ N+1 upstream pattern in {calls.caller} ({calls.path}): "
+              f"{flag['endpoint']} called {flag['calls']}x with {flag['distinct_params']} different parameters")
+    return flags
+
+
+# ============================================================
+# 2) BUDGETS + COUNTING (called around every upstream HTTP call)
+# ============================================================
+def _used(caller, bucket, period):
+    key = (bucket, period, caller)
+    with _PENDING_LOCK:
+        return _TOTALS.get(key, 0) + _UNSEEN.get(key, 0)
+
+
+def check_budget():
+    """Apply the caller's budget before an upstream call: warn, throttle or raise QuotaExceeded."""
+    caller = current_caller()
+    budget = QUOTA_BUDGETS.get(caller) or QUOTA_BUDGETS.get("default")
+    if not budget:
+        return
+    periods = _periods()
+    for bucket in ("hour", "day"):
+        limit = budget.get(bucket)
+        if not limit:
+            continue
+        used = _used(caller, bucket, periods[bucket])
+        warn_at = budget.get("warn_at", QUOTA_WARN_AT)
+        if used >= limit * warn_at:
+            level = "over" if used >= limit else "near"
+            key = (caller, bucket, periods[bucket], level)
+            if key not in _WARNED:
+                _WARNED.add(key)
+                print(f"⚠️ {caller} has used {used}/{limit} upstream calls this {bucket}")
+        if used < limit:
+            continue
+        action = budget.get("action", "warn")
+        if action == "reject":
+            raise QuotaExceeded(caller, bucket, used, limit, _seconds_left(bucket))
+        if action == "throttle":
+            time.sleep(QUOTA_THROTTLE_SECONDS)
+
+
+def _signature(params, body):
+    """Identity of the record(s) a call asks for, ignoring paging/window parameters."""
+    picked = {}
+    for source in (params, body):
+        if isinstance(source, dict):
+            picked.update({k: v for k, v in source.items() if k not in PAGING_PARAMS})
+    return json.dumps(picked, sort_keys=True, default=str)
+
+
+def count_call(method, endpoint, params=None, body=None):
+    """Record one upstream HTTP call for the current caller (and inbound request)."""
+    caller = current_caller()
+    name = f"{method} {endpoint}"
+    request_calls = _REQUEST.get()
+    if request_calls is not None:
+        request_calls.add(name, _signature(params, body))
+
+    with _PENDING_LOCK:
+        for bucket, period in _periods().items():
+            usage_key = (bucket, period, caller, name)
+            _PENDING["usage"][usage_key] = _PENDING["usage"].get(usage_key, 0) + 1
+            _UNSEEN[(bucket, period, caller)] = _UNSEEN.get((bucket, period, caller), 0) + 1
+    _ensure_flusher()
+
+
+# ============================================================
+# 3) BACKGROUND FLUSH
+# ============================================================
+def _take_pending():
+    with _PENDING_LOCK:
+        taken = dict(_PENDING)
+        _PENDING.update(usage={}, requests={}, flags=[])
+    return taken
+
+
+def _restore_pending(taken):
+    """Put back counts a failed flush could not write, for the next attempt."""
+    with _PENDING_LOCK:
+        for key, calls in taken["usage"].items():
+            _PENDING["usage"][key] = _PENDING["usage"].get(key, 0) + calls
+        for key, (requests_, calls, max_calls) in taken["requests"].items():
+            entry = _PENDING["requests"].setdefault(key, [0, 0, 0])
+            entry[0] += requests_
+            entry[1] += calls
+            entry[2] = max(entry[2], max_calls)
+        _PENDING["flags"][:0] = taken["flags"]
+
+
+def _write(conn, taken, periods):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO usage (bucket, period, caller, endpoint, calls) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (bucket, period, caller, endpoint) DO UPDATE SET calls = calls + excluded.calls",
+            [(*key, calls) for key, calls in taken["usage"].items()],
+        )
+        conn.executemany(
+            "INSERT INTO route_requests (day, caller, requests, upstream_calls, max_calls) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, caller) DO UPDATE SET requests = requests + excluded.requests, "
+            "upstream_calls = upstream_calls + excluded.upstream_calls, "
+            "max_calls = MAX(max_calls, excluded.max_calls)",
+            [(*key, *entry) for key, entry in taken["requests"].items()],
+        )
+        conn.executemany(
+            "INSERT INTO n_plus_one (at, caller, path, endpoint, calls, distinct_params) VALUES (?, ?, ?, ?, ?, ?)",
+            taken["flags"],
+        )
+        if _LAST_PRUNE["hour"] != periods["hour"]:
+            _LAST_PRUNE["hour"] = periods["hour"]
+            _prune(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def flush():
+    """Write pending counts to quota.db and refresh the host-wide totals budgets use."""
+    with _FLUSH_LOCK:
+        taken = _take_pending()
+        periods = _periods()
+        try:
+            conn = _conn()
+            _write(conn, taken, periods)
+            rows = conn.execute(
+                "SELECT bucket, period, caller, SUM(calls) FROM usage "
+                "WHERE (bucket = 'hour' AND period = ?) OR (bucket = 'day' AND period = ?) "
+                "GROUP BY bucket, period, caller",
+                (periods["hour"], periods["day"]),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ Quota store unavailable: {e}")
+            _restore_pending(taken)
+            return False
+
+        flushed = {}
+        for (bucket, period, caller, _), calls in taken["usage"].items():
+            flushed[(bucket, period, caller)] = flushed.get((bucket, period, caller), 0) + calls
+        with _PENDING_LOCK:
+            _TOTALS.clear()
+            _TOTALS.update({(bucket, period, caller): calls for bucket, period, caller, calls in rows})
+            for key, calls in flushed.items():
+                left = _UNSEEN.get(key, 0) - calls
+                if left > 0:
+                    _UNSEEN[key] = left
+                else:
+                    _UNSEEN.pop(key, None)
+        return True
+
+
+def _flush_loop():
+    # First pass right away, so a fresh process picks up host-wide totals early
+    while True:
+        flush()
+        time.sleep(QUOTA_FLUSH_SECONDS)
+
+
+def _ensure_flusher():
+    if _FLUSHER["thread"] is not None:
+        return
+    with _PENDING_LOCK:
+        if _FLUSHER["thread"] is None:
+            _FLUSHER["thread"] = threading.Thread(target=_flush_loop, name="quota-flush", daemon=True)
+            _FLUSHER["thread"].start()
+            atexit.register(flush)
+
+
+def _prune(conn):
+    cutoff = time.time() - QUOTA_RETENTION_DAYS * 86400
+    cutoff_day = datetime.fromtimestamp(cutoff).strftime("%Y-%m-%d")
+    conn.execute("DELETE FROM usage WHERE period < ?", (cutoff_day,))
+    conn.execute("DELETE FROM route_requests WHERE day < ?", (cutoff_day,))
+    conn.execute("DELETE FROM n_plus_one WHERE at < ?", (cutoff,))
+
+
+# ============================================================
+# 4) REPORT
+# ============================================================
+def quota_report(day: str = None, n_plus_one_limit: int = 50):
+    """Usage per caller/endpoint, budget status, calls per inbound request and N+1 flags."""
+    flush()
+    periods = _periods()
+    day = day or periods["day"]
+    conn = _conn()
+
+    usage = {}
+    for caller, endpoint, calls in conn.execute(
+            "SELECT caller, endpoint, calls FROM usage WHERE bucket = 'day' AND period = ? "
+            "ORDER BY calls DESC", (day,)):
+        entry = usage.setdefault(caller, {"calls": 0, "endpoints": {}})
+        entry["calls"] += calls
+        entry["endpoints"][endpoint] = calls
+
+    budgets = {}
+    for caller, budget in QUOTA_BUDGETS.items():
+        status = {"action": budget.get("action", "warn")}
+        for bucket in ("hour", "day"):
+            if budget.get(bucket):
+                used = _used(caller, bucket, periods[bucket])
+                status[bucket] = {"used": used, "budget": budget[bucket],
+                                  "percent": round(used / budget[bucket] * 100, 1)}
+        budgets[caller] = status
+
+    per_request = {
+        caller: {
+            "requests": requests_,
+            "upstream_calls": calls,
+            "avg_calls": round(calls / requests_, 2) if requests_ else 0,
+            "max_calls": max_calls,
+        }
+        for caller, requests_, calls, max_calls in conn.execute(
+            "SELECT caller, requests, upstream_calls, max_calls FROM route_requests WHERE day = ? "
+            "ORDER BY upstream_calls DESC", (day,))
+    }
+
+    flags = [
+        {"at": at, "caller": caller, "path": path, "endpoint": endpoint,
+         "calls": calls, "distinct_params": distinct}
+        for at, caller, path, endpoint, calls, distinct in conn.execute(
+            "SELECT at, caller, path, endpoint, calls, distinct_params FROM n_plus_one "
+            "ORDER BY at DESC LIMIT ?", (n_plus_one_limit,))
+    ]
+
+    return {
+        "day": day,
+        "total_calls": sum(entry["calls"] for entry in usage.values()),
+        "by_caller": usage,
+        "budgets": budgets,
+        "per_request": per_request,
+        "n_plus_one": flags,
+    }
@@ -0,0 +1,301 @@
+"""
+Incremental sales reporting backed by per-day local partitions.
+
+Each day of sales is stored once as a small columnar file under
+MINDBODY_DATA_DIR/sales/YYYY-MM-DD.part:
+
+    line 1  : JSON header (columns, typecodes, lengths, string dictionaries)
+    rest    : raw array bytes, one column after another
+
+A partition is final, and never fetched again, once it was fetched at
+least REPORTS_REFRESH_DAYS after its day began (its header's fetched_at);
+earlier copies, e.g. today's, are re-fetched at most every
+REPORTS_RECENT_TTL seconds whenever a report touches them. Days after
+today are never written. Missing ranges are fetched as concurrent
+week shards and each shard is written as soon as it arrives. Per-day
+aggregates are memoized, so a report over a year is a merge of ~365 small
+dicts.
+"""
+
+import os
+import json
+import time
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+
+from deadlines import DeadlineExceeded, current_deadline, record_partial
+from mindbody_client import iter_sales
+
+DATA_DIR = os.getenv("MINDBODY_DATA_DIR", "data")
+PARTITION_DIR = os.path.join(DATA_DIR, "sales")
+REPORTS_REFRESH_DAYS = int(os.getenv("REPORTS_REFRESH_DAYS", "2"))
+REPORTS_RECENT_TTL = int(os.getenv("REPORTS_RECENT_TTL", "300"))
+REPORTS_SHARD = os.getenv("REPORTS_SHARD", "week")
+
+# column name -> array typecode
+ITEM_COLUMNS = {"sale_id": "q", "location_id": "q", "item_type": "H", "amount": "d"}
+PAYMENT_COLUMNS = {"sale_id": "q", "method": "H", "amount": "d"}
+NO_LOCATION = -1
+
+GROUP_BYS = ("day", "location", "item_type", "payment_method")
+
+# day (YYYY-MM-DD) -> (fetched_at, aggregates)
+_AGGREGATES = {}
+_INGEST_LOCK = threading.Lock()
+
+
+# ============================================================
+# 1) PARTITION FILES
+# ============================================================
+def _partition_path(day):
+    return os.path.join(PARTITION_DIR, f"{day}.part")
+
+
+def _write_partition(day, items, payments, item_types, payment_methods):
+    """Write one day atomically (tmp file + rename)."""
+    os.makedirs(PARTITION_DIR, exist_ok=True)
+    tables = {"items": (ITEM_COLUMNS, items), "payments": (PAYMENT_COLUMNS, payments)}
+    header = {
+        "day": day,
+        "fetched_at": time.time(),
+        "dicts": {"item_type": item_types, "method": payment_methods},
+        "tables": {
+            name: {col: [code, len(columns[col])] for col, code in spec.items()}
+            for name, (spec, columns) in tables.items()
+        },
+    }
+
+    path = _partition_path(day)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        for spec, columns in tables.values():
+            for col in spec:
+                columns[col].tofile(f)
+    os.replace(tmp_path, path)
+    return header
+
+
+def _read_partition(day):
+    """Load a partition as (header, {"items": cols, "payments": cols})."""
+    with open(_partition_path(day), "rb") as f:
+        header = json.loads(f.readline())
+        tables = {}
+        for name, spec in header["tables"].items():
+            columns = {}
+            for col, (code, length) in spec.items():
+                column = array(code)
+                column.fromfile(f, length)
+                columns[col] = column
+            tables[name] = columns
+    return header, tables
+
+
+# ============================================================
+# 2) INGEST FROM MINDBODY
+# ============================================================
+def _item_type(item):
+    if item.get("ContractId"):
+        return "Contract"
+    return "Service" if item.get("IsService") else "Product"
+
+
+def _item_amount(item):
+    if item.get("TotalAmount") is not None:
+        return float(item["TotalAmount"])
+    return float(item.get("UnitPrice") or 0) * float(item.get("Quantity") or 1)
+
+
+def _encode(value, dictionary, index):
+    code = index.get(value)
+    if code is None:
+        code = index[value] = len(dictionary)
+        dictionary.append(value)
+    return code
+
+
+def _store_days(days, sales):
+    """Split fetched sales into per-day columns and write every day in `days`."""
+    by_day = {day: [] for day in days}
+    for sale in sales:
+        sale_day = str(sale.get("SaleDateTime") or sale.get("SaleDate") or "")[:10]
+        if sale_day in by_day:
+            by_day[sale_day].append(sale)
+
+    for day, day_sales in by_day.items():
+        items = {col: array(code) for col, code in ITEM_COLUMNS.items()}
+        payments = {col: array(code) for col, code in PAYMENT_COLUMNS.items()}
+        item_types, type_index = [], {}
+        methods, method_index = [], {}
+
+        for sale in day_sales:
+            sale_id = int(sale.get("Id") or 0)
+            location_id = sale.get("LocationId")
+            location_id = NO_LOCATION if location_id is None else int(location_id)
+            for item in sale.get("PurchasedItems") or []:
+                items["sale_id"].append(sale_id)
+                items["location_id"].append(location_id)
+                items["item_type"].append(_encode(_item_type(item), item_types, type_index))
+                items["amount"].append(_item_amount(item))
+            for payment in sale.get("Payments") or []:
+                method = str(payment.get("Type") or payment.get("Method") or "Unknown")
+                payments["sale_id"].append(sale_id)
+                payments["method"].append(_encode(method, methods, method_index))
+                payments["amount"].append(float(payment.get("Amount") or 0))
+
+        _write_partition(day, items, payments, item_types, methods)
+        _AGGREGATES.pop(day, None)
+
+
+def _days_between(start_date, end_date):
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def _days_through_today(start_date, end_date):
+    """
+    Days of the range up to today; later days have no sales yet and are not
+    stored. Raises ValueError for dates that are not YYYY-MM-DD.
+    """
+    start, end = date.fromisoformat(start_date), min(date.fromisoformat(end_date), date.today())
+    return _days_between(start.isoformat(), end.isoformat()) if end >= start else []
+
+
+def _fetched_at(day):
+    """fetched_at from a partition's header, or None if it is missing/unreadable."""
+    try:
+        with open(_partition_path(day), "rb") as f:
+            return json.loads(f.readline())["fetched_at"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _is_final(day, fetched_at):
+    """Fetched late enough that Mindbody will not change the day any more."""
+    final_from = datetime.fromisoformat(day) + timedelta(days=REPORTS_REFRESH_DAYS)
+    return fetched_at >= final_from.timestamp()
+
+
+def _stale_days(days, force=False):
+    """Days that are missing, or not final and not fetched in the last REPORTS_RECENT_TTL."""
+    now = time.time()
+    stale = []
+    for day in days:
+        fetched_at = None if force else _fetched_at(day)
+        if fetched_at is None:
+            stale.append(day)
+        elif not _is_final(day, fetched_at) and now - fetched_at > REPORTS_RECENT_TTL:
+            stale.append(day)
+    return stale
+
+
+def _contiguous_runs(days):
+    runs = []
+    for day in days:
+        if runs and date.fromisoformat(day) - date.fromisoformat(runs[-1][-1]) == timedelta(days=1):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    return runs
+
+
+def _acquire_ingest_lock():
+    """Take _INGEST_LOCK, waiting no longer than the route's remaining deadline."""
+    deadline = current_deadline()
+    if deadline is None:
+        _INGEST_LOCK.acquire()
+    elif not _INGEST_LOCK.acquire(timeout=max(deadline.remaining(), 0)):
+        raise DeadlineExceeded("Timed out waiting for a concurrent sales sync", deadline=deadline)
+
+
+def sync_sales(start_date: str, end_date: str, force: bool = False):
+    """Fetch only the missing / not yet final day partitions for a range (up to today)."""
+    days = _days_through_today(start_date, end_date)
+    stored = []
+    # Days already written stay on disk, so a retry after a 504 resumes from here
+    record_partial("sales_days_stored", stored)
+    for run in _contiguous_runs(_stale_days(days, force)):
+        # Lock per run; re-check under it, a concurrent sync may have stored these days already
+        _acquire_ingest_lock()
+        try:
+            for sub_run in _contiguous_runs(run if force else _stale_days(run)):
+                for shard_start, shard_end, data in iter_sales(sub_run[0], sub_run[-1], REPORTS_SHARD,
+                                                               use_cache=False):
+                    if not isinstance(data, dict) or "Sales" not in data:
+                        raise RuntimeError(f"Failed to fetch sales {shard_start}..{shard_end}: {data}")
+                    shard_days = _days_between(shard_start, shard_end)
+                    _store_days(shard_days, data["Sales"])
+                    stored.extend(shard_days)
+        finally:
+            _INGEST_LOCK.release()
+    return {"days": len(days), "fetched": len(stored), "reused": len(days) - len(stored)}
+
+
+# ============================================================
+# 3) AGGREGATION
+# ============================================================
+def _aggregate_partition(day):
+    """Single pass per column set; result is memoized until the day is rewritten."""
+    header, tables = _read_partition(day)
+    items, payments = tables["items"], tables["payments"]
+    item_types = header["dicts"]["item_type"]
+    methods = header["dicts"]["method"]
+
+    by_location, by_type = {}, [0.0] * len(item_types)
+    for location_id, type_code, amount in zip(items["location_id"], items["item_type"], items["amount"]):
+        by_location[location_id] = by_location.get(location_id, 0.0) + amount
+        by_type[type_code] += amount
+
+    by_method = [0.0] * len(methods)
+    for method_code, amount in zip(payments["method"], payments["amount"]):
+        by_method[method_code] += amount
+
+    return {
+        "revenue": sum(items["amount"]),
+        "sales": len(set(items["sale_id"]) | set(payments["sale_id"])),
+        "items": len(items["amount"]),
+        "location": {
+            ("none" if loc == NO_LOCATION else str(loc)): total for loc, total in by_location.items()
+        },
+        "item_type": dict(zip(item_types, by_type)),
+        "payment_method": dict(zip(methods, by_method)),
+    }
+
+
+def _day_aggregates(day):
+    fetched_at = os.path.getmtime(_partition_path(day))
+    cached = _AGGREGATES.get(day)
+    if cached is None or cached[0] != fetched_at:
+        cached = (fetched_at, _aggregate_partition(day))
+        _AGGREGATES[day] = cached
+    return cached[1]
+
+
+def sales_report(start_date: str, end_date: str, group_by: str = "day"):
+    """Revenue report for a date range, grouped by day/location/item_type/payment_method."""
+    if group_by not in GROUP_BYS:
+        return {"error": f"Invalid group_by. Use: {', '.join(GROUP_BYS)}"}
+
+    sync = sync_sales(start_date, end_date)
+
+    totals = {"revenue": 0.0, "sales": 0, "items": 0}
+    groups = {}
+    for day in _days_through_today(start_date, end_date):
+        aggregates = _day_aggregates(day)
+        for field in totals:
+            totals[field] += aggregates[field]
+        if group_by == "day":
+            groups[day] = aggregates["revenue"]
+        else:
+            for key, amount in aggregates[group_by].items():
+                groups[key] = groups.get(key, 0.0) + amount
+
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "group_by": group_by,
+        "totals": {**totals, "revenue": round(totals["revenue"], 2)},
+        "groups": {key: round(amount, 2) for key, amount in groups.items()},
+        "sync": sync,
+    }
@@ -0,0 +1,115 @@
+"""
+Script to post sample Mindbody webhook events to a local API instance
+Payloads follow: https://developers.mindbodyonline.com/WebhooksDocumentation
+Signs each body with MINDBODY_WEBHOOK_SIGNATURE_KEY, same as Mindbody does.
+"""
+
+import os
+import json
+import uuid
+from datetime import datetime, timezone
+
+import requests
+from dotenv import load_dotenv
+
+from webhooks import sign_payload
+
+load_dotenv()
+
+SIGNATURE_KEY = os.getenv("MINDBODY_WEBHOOK_SIGNATURE_KEY")
+SITE_ID = os.getenv("MINDBODY_SITE_ID")
+WEBHOOK_URL = os.getenv("WEBHOOK_TARGET_URL", "http://localhost:8000/webhooks/mindbody")
+
+# ============================================================================
+# SAMPLE EVENT DATA
+# ============================================================================
+
+SAMPLE_EVENTS = {
+    "client.created": {
+        "clientId": "100015631",
+        "firstName": "Jane",
+        "lastName": "Doe",
+        "email": "jane.doe@example.com",
+    },
+    "client.updated": {
+        "clientId": "100015630",
+        "firstName": "John",
+        "lastName": "Doe",
+        "email": "john.doe+updated@example.com",
+        "mobilePhone": "5551234567",
+    },
+    "classRosterBooking.created": {
+        "classId": 1234,
+        "classRosterBookingId": 98765,
+        "clientId": "100015630",
+        "maxCapacity": 20,
+        "totalBooked": 12,
+    },
+    "classRosterBooking.cancelled": {
+        "classId": 1234,
+        "classRosterBookingId": 98765,
+        "clientId": "100015630",
+    },
+    "clientSale.created": {
+        "saleId": 55501,
+        "purchasingClientId": "100015630",
+        "locationId": 1,
+        "totalAmountPaid": 25.00,
+    },
+}
+
+
+# ============================================================================
+# SEND EVENT
+# ============================================================================
+
+def send_event(event_id, event_data):
+    """
+    Wrap event data in the Mindbody envelope, sign it and post it
+    """
+    payload = {
+        "messageId": str(uuid.uuid4()),
+        "eventId": event_id,
+        "eventSchemaVersion": 1,
+        "eventInstanceOriginationDateTime": datetime.now(timezone.utc).isoformat(),
+        "eventData": {"siteId": SITE_ID, **event_data},
+    }
+    raw_body = json.dumps(payload).encode("utf-8")
+
+    headers = {"Content-Type": "application/json"}
+    if SIGNATURE_KEY:
+        headers["X-Mindbody-Signature"] = sign_payload(raw_body, SIGNATURE_KEY)
+
+    print(f"\n➡️  {event_id} → {WEBHOOK_URL}")
+    try:
+        response = requests.post(WEBHOOK_URL, data=raw_body, headers=headers, timeout=10)
+        print(f"Status Code: {response.status_code}")
+        print(f"Response: {response.text[:500]}")
+    except Exception as e:
+        print(f"❌ Exception: {e}")
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+if __name__ == "__main__":
+    if not SIGNATURE_KEY:
+        print("⚠️  MINDBODY_WEBHOOK_SIGNATURE_KEY is not set; the API will reject events.")
+
+    event_ids = list(SAMPLE_EVENTS)
+    print("\nSample events:")
+    for i, event_id in enumerate(event_ids, 1):
+        print(f"{i}. {event_id}")
+    print(f"{len(event_ids) + 1}. Send all")
+
+    choice = input(f"\nEnter your choice (1-{len(event_ids) + 1}): ").strip()
+
+    if choice == str(len(event_ids) + 1):
+        for event_id in event_ids:
+            send_event(event_id, SAMPLE_EVENTS[event_id])
+    elif choice.isdigit() and 1 <= int(choice) <= len(event_ids):
+        event_id = event_ids[int(choice) - 1]
+        send_event(event_id, SAMPLE_EVENTS[event_id])
+    else:
+        print("\n❌ Invalid choice!")
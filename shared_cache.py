@@ -0,0 +1,169 @@
+"""
+Shared L2 cache tier for all uvicorn workers on a host.
+
+cache.py keeps its in-process dict as L1 and falls back to this SQLite file
+(WAL mode, MINDBODY_DATA_DIR/cache.db) on a miss, so one worker's upstream
+fetch warms every worker and the cached data is stored once per host.
+Values are pickled. Entries carry their own expiry; once the file passes
+CACHE_L2_MAX_BYTES the least recently read entries are evicted.
+
+The file is trusted local state written only by this app (pickle).
+"""
+
+import os
+import ast
+import time
+import pickle
+import sqlite3
+import threading
+
+DATA_DIR = os.getenv("MINDBODY_DATA_DIR", "data")
+CACHE_L2_DB = os.path.join(DATA_DIR, "cache.db")
+CACHE_L2_MAX_BYTES = int(os.getenv("CACHE_L2_MAX_BYTES", str(256 * 1024 * 1024)))
+# Reads refresh accessed_at at most this often, to keep hits from becoming writes
+CACHE_L2_TOUCH_SECONDS = 60
+CACHE_L2_EVICT_EVERY = 100   # sets between size checks
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+"""
+
+_LOCAL = threading.local()
+_SETS = {"count": 0}
+
+
+def _conn():
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(CACHE_L2_DB, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _LOCAL.conn = conn
+    return conn
+
+
+def _key(key):
+    return repr(key)
+
+
+# ============================================================
+# 1) READ / WRITE
+# ============================================================
+def l2_get(namespace, key):
+    """(expires_at, value) for a live entry, or None."""
+    now = time.time()
+    conn = _conn()
+    row = conn.execute(
+        "SELECT expires_at, accessed_at, value FROM entries WHERE namespace = ? AND key = ?",
+        (namespace, _key(key)),
+    ).fetchone()
+    if row is None:
+        return None
+    expires_at, accessed_at, blob = row
+    if now >= expires_at:
+        conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                     (namespace, _key(key), now))
+        return None
+    if now - accessed_at >= CACHE_L2_TOUCH_SECONDS:
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                     (now, namespace, _key(key)))
+    return expires_at, pickle.loads(blob)
+
+
+def l2_set(namespace, key, value, expires_at):
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    conn = _conn()
+    conn.execute(
+        "INSERT OR REPLACE INTO entries (namespace, key, expires_at, accessed_at, size, value) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (namespace, _key(key), expires_at, time.time(), len(blob), blob),
+    )
+    _SETS["count"] += 1
+    if _SETS["count"] % CACHE_L2_EVICT_EVERY == 0:
+        l2_evict()
+
+
+def l2_items(namespace):
+    """[(key, expires_at, value)] for live entries in a namespace."""
+    rows = _conn().execute(
+        "SELECT key, expires_at, value FROM entries WHERE namespace = ? AND expires_at > ?",
+        (namespace, time.time()),
+    ).fetchall()
+    # Keys round-trip through repr(); they are tuples/strings of plain values
+    return [(ast.literal_eval(key), expires_at, pickle.loads(blob))
+            for key, expires_at, blob in rows]
+
+
+def l2_keys(namespace):
+    """Keys of live entries in a namespace, without loading their values."""
+    rows = _conn().execute(
+        "SELECT key FROM entries WHERE namespace = ? AND expires_at > ?",
+        (namespace, time.time()),
+    ).fetchall()
+    return [ast.literal_eval(key) for key, in rows]
+
+
+# ============================================================
+# 2) INVALIDATE / PATCH / EVICT
+# ============================================================
+def l2_invalidate(namespace, key=None):
+    conn = _conn()
+    if key is not None:
+        return conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?",
+                            (namespace, _key(key))).rowcount
+    return conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,)).rowcount
+
+
+def l2_patch(namespace, key, patch_fn):
+    """Apply patch_fn to a live entry in one transaction; True if patched."""
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT expires_at, value FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, _key(key)),
+        ).fetchone()
+        patched = row is not None and time.time() < row[0]
+        if patched:
+            blob = pickle.dumps(patch_fn(pickle.loads(row[1])), protocol=pickle.HIGHEST_PROTOCOL)
+            conn.execute("UPDATE entries SET value = ?, size = ? WHERE namespace = ? AND key = ?",
+                         (blob, len(blob), namespace, _key(key)))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return patched
+
+
+def l2_evict():
+    """Drop expired entries, then least recently read ones until under the size cap."""
+    conn = _conn()
+    conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total <= CACHE_L2_MAX_BYTES:
+        return 0
+    evicted = 0
+    for namespace, key, size in conn.execute(
+            "SELECT namespace, key, size FROM entries ORDER BY accessed_at").fetchall():
+        if total <= CACHE_L2_MAX_BYTES:
+            break
+        conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        total -= size
+        evicted += 1
+    return evicted
+
+
+def l2_stats():
+    count, total = _conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+    return {"entries": count, "bytes": total, "max_bytes": CACHE_L2_MAX_BYTES}
@@ -0,0 +1,50 @@
+import importlib
+
+import pytest
+
+import negative_cache
+
+NOT_FOUND = {"Error": {"Code": "ClientNotFound", "Message": "Client not found."}}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setenv("NEGATIVE_CACHE_TTL", "3")
+    monkeypatch.setenv("NEGATIVE_CACHE_BITS", "4096")
+    module = importlib.reload(negative_cache)
+    clock = [1000.0]
+    monkeypatch.setattr(module.time, "time", lambda: clock[0])
+    yield module, clock
+    monkeypatch.undo()
+    importlib.reload(negative_cache)
+
+
+def test_entry_expires_after_idle_period(cache):
+    nc, clock = cache
+    assert nc.negative_set("client", "X1", NOT_FOUND)
+    assert nc.negative_get("client", "X1") is not None
+    clock[0] += 10
+    assert nc.negative_get("client", "X1") is None
+    assert nc.negative_cache_stats()["generations"] == 1
+
+
+def test_entry_never_outlives_ttl(cache):
+    nc, clock = cache
+    for _ in range(12):
+        clock[0] += 0.5
+        nc.negative_get("client", "other")
+    nc.negative_set("client", "X2", NOT_FOUND)
+    stored_at = clock[0]
+    while nc.negative_get("client", "X2") is not None:
+        clock[0] += 0.25
+    assert clock[0] - stored_at <= nc.NEGATIVE_CACHE_TTL
+
+
+def test_allowed_id_stays_allowed_until_its_filters_are_gone(cache):
+    nc, clock = cache
+    nc.negative_set("client", "X3", NOT_FOUND)
+    clock[0] += 0.9
+    nc.negative_allow("X3")
+    for _ in range(20):
+        clock[0] += 0.25
+        assert nc.negative_get("client", "X3") is None
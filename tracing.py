@@ -0,0 +1,217 @@
+"""
+Lightweight request tracing with tail-based sampling.
+
+Every request gets a trace ID (from an incoming W3C `traceparent` header,
+or generated). Spans are recorded for the route, ensure_token, each
+mb_request call and attempt, and JSON decoding. When the request finishes
+the whole trace is kept if it was slow (>= TRACE_SLOW_MS) or failed, and
+otherwise with probability TRACE_SAMPLE_RATE.
+
+Kept traces are exported as OTLP/JSON, either POSTed to a local collector
+(TRACE_OTLP_ENDPOINT, e.g. http://localhost:4318/v1/traces) or appended
+to TRACE_FILE (one ExportTraceServiceRequest per line).
+"""
+
+import os
+import re
+import json
+import time
+import queue
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import requests
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(os.getenv("MINDBODY_DATA_DIR", "data"), "traces.jsonl"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "mindbody-integration-api")
+
+# OTLP span kinds / status codes
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_TRACE = contextvars.ContextVar("mindbody_trace", default=None)
+_SPAN = contextvars.ContextVar("mindbody_span", default=None)
+
+_EXPORT_QUEUE = queue.Queue(maxsize=1000)
+_EXPORTER_LOCK = threading.Lock()
+_exporter_started = False
+
+
+class Trace:
+    def __init__(self, trace_id, remote_parent_id=None):
+        self.trace_id = trace_id
+        self.remote_parent_id = remote_parent_id
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, kind, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.status_message = ""
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+# ============================================================
+# 1) SPANS
+# ============================================================
+@contextmanager
+def span(name, kind=KIND_INTERNAL, **attributes):
+    """Record a child span of the current one; a no-op outside a traced request."""
+    trace = _TRACE.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+
+    parent = _SPAN.get()
+    current = Span(name, trace.trace_id, parent.span_id if parent else trace.remote_parent_id,
+                   kind, attributes)
+    token = _SPAN.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _SPAN.reset(token)
+        trace.add(current)
+
+
+def begin_trace(headers):
+    """Start a trace for an incoming request; returns (trace, token) or (None, None)."""
+    if not TRACING_ENABLED:
+        return None, None
+
+    match = _TRACEPARENT.match(headers.get("traceparent", "").strip().lower())
+    if match:
+        trace = Trace(match.group(1), remote_parent_id=match.group(2))
+    else:
+        trace = Trace(os.urandom(16).hex())
+    return trace, _TRACE.set(trace)
+
+
+def end_trace(trace, token):
+    """Tail-sampling decision once the whole request is known."""
+    _TRACE.reset(token)
+    root = next((s for s in trace.spans if s.parent_id == trace.remote_parent_id), None)
+    if root is None:
+        return False
+
+    keep = (
+        root.status == STATUS_ERROR
+        or any(s.status == STATUS_ERROR for s in trace.spans)
+        or root.duration_ms() >= TRACE_SLOW_MS
+        or random.random() < TRACE_SAMPLE_RATE
+    )
+    if keep:
+        _export(trace.spans)
+    return keep
+
+
+# ============================================================
+# 2) OTLP/JSON EXPORT
+# ============================================================
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def to_otlp(spans):
+    """ExportTraceServiceRequest (OTLP/JSON) for a list of finished spans."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "mindbody-tracing"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": s.kind,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": _otlp_attributes(s.attributes),
+                    "status": {"code": s.status, "message": s.status_message},
+                } for s in spans],
+            }],
+        }]
+    }
+
+
+def _export_worker():
+    while True:
+        payload = to_otlp(_EXPORT_QUEUE.get())
+        try:
+            if TRACE_OTLP_ENDPOINT:
+                requests.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=5)
+            else:
+                os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload) + "\n")
+        except Exception as e:
+            print(f"⚠️ Trace export failed: {e}")
+
+
+def _export(spans):
+    """Hand spans to the background exporter; drop them if it is backed up."""
+    global _exporter_started
+    if not _exporter_started:
+        with _EXPORTER_LOCK:
+            if not _exporter_started:
+                threading.Thread(target=_export_worker, name="trace-exporter", daemon=True).start()
+                _exporter_started = True
+    try:
+        _EXPORT_QUEUE.put_nowait(spans)
+    except queue.Full:
+        pass
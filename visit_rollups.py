@@ -0,0 +1,354 @@
+"""
+Materialized visit/attendance rollups for every client.
+
+A background job walks all clients, pulls only visits newer than each
+client's stored cursor (minus a short lookback so late status changes are
+picked up and cancelled bookings dropped), and keeps per-client rollups in
+MINDBODY_DATA_DIR/visits.db: visits per week, current/longest weekly streak,
+last visit, no-show and late-cancel rates. Attendance counts signed-in
+visits only. Queries never call Mindbody.
+
+Run one pass by hand with: python visit_rollups.py
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+from mindbody_client import get_clients, get_client_visits
+from quota import QuotaExceeded, tagged
+
+DATA_DIR = os.getenv("MINDBODY_DATA_DIR", "data")
+ROLLUP_DB = os.path.join(DATA_DIR, "visits.db")
+ROLLUP_INTERVAL_MINUTES = int(os.getenv("ROLLUP_INTERVAL_MINUTES", "0"))  # 0 = no background job
+ROLLUP_LOOKBACK_DAYS = int(os.getenv("ROLLUP_LOOKBACK_DAYS", "7"))
+CLIENT_PAGE_SIZE = 200
+VISIT_PAGE_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    id TEXT PRIMARY KEY,
+    client_id TEXT NOT NULL,
+    start_datetime TEXT NOT NULL,
+    class_id INTEGER,
+    signed_in INTEGER NOT NULL DEFAULT 0,
+    late_cancelled INTEGER NOT NULL DEFAULT 0,
+    missed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS visits_client ON visits (client_id, start_datetime);
+CREATE TABLE IF NOT EXISTS cursors (
+    client_id TEXT PRIMARY KEY,
+    last_visit_at TEXT,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS weekly_visits (
+    client_id TEXT NOT NULL,
+    week_start TEXT NOT NULL,
+    visits INTEGER NOT NULL,
+    PRIMARY KEY (client_id, week_start)
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    client_id TEXT PRIMARY KEY,
+    total_visits INTEGER NOT NULL,
+    last_visit TEXT,
+    current_streak_weeks INTEGER NOT NULL,
+    longest_streak_weeks INTEGER NOT NULL,
+    no_show_rate REAL NOT NULL,
+    late_cancel_rate REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rollups_last_visit ON rollups (last_visit);
+"""
+
+_WRITE_LOCK = threading.Lock()
+_JOB_LOCK = threading.Lock()
+_JOB_STATE = {"running": False, "last_run": None, "last_result": None}
+
+
+# ============================================================
+# 1) STORE
+# ============================================================
+def _connect():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(ROLLUP_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _week_start(day: date):
+    return day - timedelta(days=day.weekday())
+
+
+def _streaks(week_starts, today: date):
+    """Current and longest run of consecutive weeks with at least one visit."""
+    weeks = sorted(date.fromisoformat(w) for w in week_starts)
+    longest = run = 0
+    previous = None
+    for week in weeks:
+        run = run + 1 if previous and week - previous == timedelta(weeks=1) else 1
+        longest = max(longest, run)
+        previous = week
+
+    # A streak is still current if the last visit week is this week or last week
+    this_week = _week_start(today)
+    current = run if previous and this_week - previous <= timedelta(weeks=1) else 0
+    return current, longest
+
+
+def _recompute_rollup(conn, client_id, now):
+    """Rebuild weekly counts and the rollup row for one client."""
+    now_iso = now.isoformat(timespec="seconds")
+    rows = conn.execute(
+        "SELECT start_datetime, signed_in, late_cancelled, missed FROM visits "
+        "WHERE client_id = ? AND start_datetime <= ?",
+        (client_id, now_iso),
+    ).fetchall()
+
+    weekly = {}
+    attended = late_cancelled = missed = 0
+    last_visit = None
+    for row in rows:
+        if row["late_cancelled"]:
+            late_cancelled += 1
+            continue
+        if row["missed"]:
+            missed += 1
+            continue
+        if not row["signed_in"]:
+            continue    # booked but never checked in (or cancelled before Mindbody flagged it)
+        attended += 1
+        started = row["start_datetime"]
+        week = _week_start(date.fromisoformat(started[:10])).isoformat()
+        weekly[week] = weekly.get(week, 0) + 1
+        last_visit = max(last_visit or started, started)
+
+    booked = len(rows)
+    current, longest = _streaks(weekly, now.date())
+
+    conn.execute("DELETE FROM weekly_visits WHERE client_id = ?", (client_id,))
+    conn.executemany(
+        "INSERT INTO weekly_visits (client_id, week_start, visits) VALUES (?, ?, ?)",
+        [(client_id, week, count) for week, count in weekly.items()],
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            client_id,
+            attended,
+            last_visit,
+            current,
+            longest,
+            missed / booked if booked else 0.0,
+            late_cancelled / booked if booked else 0.0,
+            time.time(),
+        ),
+    )
+
+
+# ============================================================
+# 2) INCREMENTAL INGEST
+# ============================================================
+def _all_client_ids():
+    client_ids, offset = [], 0
+    while True:
+        data = get_clients(None, CLIENT_PAGE_SIZE, offset)
+        if not isinstance(data, dict) or "Clients" not in data:
+            raise RuntimeError(f"Failed to list clients: {data}")
+        page = data["Clients"] or []
+        client_ids.extend(str(c["Id"]) for c in page if c.get("Id") is not None)
+        offset += len(page)
+        total = (data.get("PaginationResponse") or {}).get("TotalResults")
+        if len(page) < CLIENT_PAGE_SIZE or (total is not None and offset >= total):
+            return client_ids
+
+
+def _all_client_visits(client_id, start_date, end_date):
+    """Every visit in the range, paged; None if any page failed."""
+    visits, offset = [], 0
+    while True:
+        data = get_client_visits(client_id, start_date=start_date, end_date=end_date, use_cache=False,
+                                 limit=VISIT_PAGE_SIZE, offset=offset)
+        if not isinstance(data, dict) or "Visits" not in data:
+            return None
+        page = data["Visits"] or []
+        visits.extend(page)
+        offset += len(page)
+        total = (data.get("PaginationResponse") or {}).get("TotalResults")
+        if len(page) < VISIT_PAGE_SIZE or (total is not None and offset >= total):
+            return visits
+
+
+def _visit_row(client_id, visit):
+    started = str(visit.get("StartDateTime") or "")
+    visit_id = visit.get("Id") or f"{visit.get('ClassId')}:{started}"
+    return (
+        str(visit_id),
+        client_id,
+        started,
+        visit.get("ClassId"),
+        1 if visit.get("SignedIn") else 0,
+        1 if visit.get("LateCancelled") else 0,
+        1 if visit.get("Missed") else 0,
+    )
+
+
+def sync_client(conn, client_id, now=None):
+    """
+    Pull visits since this client's cursor and refresh their rollup. Local
+    visits in the re-synced window that Mindbody no longer returns (e.g.
+    cancelled bookings) are deleted.
+    """
+    now = now or datetime.now()
+    cursor = conn.execute(
+        "SELECT last_visit_at FROM cursors WHERE client_id = ?", (client_id,)
+    ).fetchone()
+
+    start_date = None
+    if cursor and cursor["last_visit_at"]:
+        since = date.fromisoformat(cursor["last_visit_at"][:10]) - timedelta(days=ROLLUP_LOOKBACK_DAYS)
+        start_date = since.isoformat()
+
+    visits = _all_client_visits(client_id, start_date, now.date().isoformat())
+    if visits is None:
+        return 0
+    rows = [_visit_row(client_id, v) for v in visits if v.get("StartDateTime")]
+    window_end = (now.date() + timedelta(days=1)).isoformat()
+
+    with _WRITE_LOCK, conn:
+        returned = {r[0] for r in rows}
+        local = conn.execute(
+            "SELECT id FROM visits WHERE client_id = ? AND start_datetime >= ? AND start_datetime < ?",
+            (client_id, start_date or "", window_end),
+        ).fetchall()
+        conn.executemany(
+            "DELETE FROM visits WHERE id = ?",
+            [(row["id"],) for row in local if row["id"] not in returned],
+        )
+        conn.executemany("INSERT OR REPLACE INTO visits VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        last_seen = max([r[2] for r in rows], default=None)
+        previous = cursor["last_visit_at"] if cursor else None
+        conn.execute(
+            "INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)",
+            (client_id, max(filter(None, [previous, last_seen]), default=None), time.time()),
+        )
+        _recompute_rollup(conn, client_id, now)
+    return len(rows)
+
+
+def run_rollup_job():
+    """One full incremental pass over every client."""
+    if not _JOB_LOCK.acquire(blocking=False):
+        return {"status": "already running"}
+    _JOB_STATE["running"] = True
+    started = time.time()
+    try:
+        conn = _connect()
+        try:
+            with tagged("job:visit-rollups"):
+                client_ids = _all_client_ids()
+                visits = failed = 0
+                for client_id in client_ids:
+                    try:
+                        visits += sync_client(conn, client_id)
+                    except QuotaExceeded:
+                        raise   # the whole pass is over budget, not this client
+                    except Exception as e:
+                        failed += 1
+                        print(f"❌ Rollup failed for client {client_id}: {e}")
+        finally:
+            conn.close()
+        result = {
+            "status": "ok",
+            "clients": len(client_ids),
+            "failed": failed,
+            "visits_ingested": visits,
+            "seconds": round(time.time() - started, 2),
+        }
+    except Exception as e:
+        result = {"status": "error", "error": str(e)}
+    finally:
+        _JOB_STATE["running"] = False
+        _JOB_STATE["last_run"] = started
+        _JOB_LOCK.release()
+
+    _JOB_STATE["last_result"] = result
+    return result
+
+
+def start_rollup_job_in_background():
+    """Kick off one pass without blocking the caller."""
+    if _JOB_STATE["running"]:
+        return {"status": "already running"}
+    threading.Thread(target=run_rollup_job, name="visit-rollups", daemon=True).start()
+    return {"status": "started"}
+
+
+def _scheduler(stop_event):
+    while not stop_event.is_set():
+        run_rollup_job()
+        stop_event.wait(ROLLUP_INTERVAL_MINUTES * 60)
+
+
+def start_rollup_scheduler():
+    """Run the job every ROLLUP_INTERVAL_MINUTES; returns a stop event (or None if disabled)."""
+    if ROLLUP_INTERVAL_MINUTES <= 0:
+        return None
+    stop_event = threading.Event()
+    threading.Thread(target=_scheduler, args=(stop_event,), name="visit-rollups-scheduler", daemon=True).start()
+    return stop_event
+
+
+def rollup_job_status():
+    return dict(_JOB_STATE, interval_minutes=ROLLUP_INTERVAL_MINUTES)
+
+
+# ============================================================
+# 3) QUERIES (local only)
+# ============================================================
+def get_client_rollup(client_id: str, weeks: int = 12):
+    conn = _connect()
+    try:
+        rollup = conn.execute("SELECT * FROM rollups WHERE client_id = ?", (client_id,)).fetchone()
+        if rollup is None:
+            return None
+        since = (_week_start(date.today()) - timedelta(weeks=weeks - 1)).isoformat()
+        weekly = conn.execute(
+            "SELECT week_start, visits FROM weekly_visits "
+            "WHERE client_id = ? AND week_start >= ? ORDER BY week_start",
+            (client_id, since),
+        ).fetchall()
+        return {**dict(rollup), "weekly_visits": {w["week_start"]: w["visits"] for w in weekly}}
+    finally:
+        conn.close()
+
+
+def get_inactive_clients(days: int = 30, include_never: bool = False, limit: int = 100, offset: int = 0):
+    """Clients whose last attended visit is older than `days`."""
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+    where = "last_visit < ?"
+    if include_never:
+        where = f"({where} OR last_visit IS NULL)"
+
+    conn = _connect()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM rollups WHERE {where}", (cutoff,)).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM rollups WHERE {where} ORDER BY last_visit LIMIT ? OFFSET ?",
+            (cutoff, limit, offset),
+        ).fetchall()
+        return {"days": days, "total": total, "clients": [dict(r) for r in rows]}
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+if __name__ == "__main__":
+    print("\n🔄 Running visit rollup job...")
+    print(run_rollup_job())
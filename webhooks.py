@@ -0,0 +1,142 @@
+"""
+Mindbody webhook handling: signature verification and cache invalidation.
+Docs: https://developers.mindbodyonline.com/WebhooksDocumentation
+
+Each supported event either patches the cached record in place (so the next
+read is still a hit) or invalidates the affected entries in cache.py.
+Events that make a client ID valid (or give it visits) also clear it from
+the negative cache.
+"""
+
+import os
+import hmac
+import base64
+import hashlib
+
+from cache import cache_invalidate, cache_items, cache_patch
+from class_index import CLASS_INDEX
+from negative_cache import negative_allow
+
+WEBHOOK_SIGNATURE_KEY = os.getenv("MINDBODY_WEBHOOK_SIGNATURE_KEY")
+
+
+# ============================================================
+# 1) SIGNATURE VERIFICATION
+# ============================================================
+def sign_payload(raw_body: bytes, key: str):
+    """Build the X-Mindbody-Signature value for a raw request body."""
+    digest = hmac.new(key.encode("utf-8"), raw_body, hashlib.sha256).digest()
+    return "sha256=" + base64.b64encode(digest).decode("ascii")
+
+
+def verify_signature(raw_body: bytes, signature: str):
+    """Check X-Mindbody-Signature against our subscription's signature key."""
+    if not WEBHOOK_SIGNATURE_KEY or not signature:
+        return False
+    expected = sign_payload(raw_body, WEBHOOK_SIGNATURE_KEY)
+    return hmac.compare_digest(expected, signature)
+
+
+# ============================================================
+# 2) CACHE PATCHERS
+# ============================================================
+def _patch_client_fields(event_data):
+    """Copy camelCase event fields onto the cached PascalCase Client record."""
+    def patch(cached):
+        client = dict(cached.get("Client") or {})
+        for field, value in event_data.items():
+            pascal = field[:1].upper() + field[1:]
+            if pascal in client:
+                client[pascal] = value
+        return {**cached, "Client": client}
+    return patch
+
+
+def _patch_class_booked(class_id, total_booked, delta):
+    """Set TotalBooked from the event, or nudge it by delta if absent."""
+    def patch(cached):
+        classes = []
+        for cls in cached.get("Classes") or []:
+            if cls.get("Id") == class_id:
+                booked = total_booked
+                if booked is None:
+                    booked = max((cls.get("TotalBooked") or 0) + delta, 0)
+                cls = {**cls, "TotalBooked": booked}
+            classes.append(cls)
+        return {**cached, "Classes": classes}
+    return patch
+
+
+def _schedule_has_class(cached, class_id):
+    return any(cls.get("Id") == class_id for cls in cached.get("Classes") or [])
+
+
+# ============================================================
+# 3) EVENT HANDLERS
+# ============================================================
+def _on_client_created(data):
+    negative_allow(data.get("clientId"))
+    return {"negative_cache": "cleared"}
+
+
+def _on_client_updated(data):
+    client_id = str(data.get("clientId"))
+    patched = cache_patch("client", client_id, _patch_client_fields(data))
+    return {"client": "patched" if patched else "not cached"}
+
+
+def _on_client_deactivated(data):
+    cache_invalidate("client", str(data.get("clientId")))
+    return {"client": "invalidated"}
+
+
+def _on_class_booking(delta):
+    def handler(data):
+        class_id = data.get("classId")
+        patch = _patch_class_booked(class_id, data.get("totalBooked"), delta)
+        patched = 0
+        for key, cached in cache_items("class_schedule"):
+            if _schedule_has_class(cached, class_id) and cache_patch("class_schedule", key, patch):
+                patched += 1
+        CLASS_INDEX.adjust_booked(class_id, data.get("totalBooked"), delta)
+        # Bookings consume the client's pricing options, so refetch their record
+        if data.get("clientId") is not None:
+            cache_invalidate("client", str(data.get("clientId")))
+            negative_allow(data.get("clientId"))
+        return {"class_schedule_patched": patched, "client": "invalidated"}
+    return handler
+
+
+def _on_class_booking_status(data):
+    if data.get("clientId") is not None:
+        cache_invalidate("client", str(data.get("clientId")))
+    return {"client": "invalidated"}
+
+
+def _on_sale_created(data):
+    dropped = cache_invalidate("sales")
+    if data.get("purchasingClientId") is not None:
+        cache_invalidate("client", str(data.get("purchasingClientId")))
+    return {"sales_invalidated": dropped}
+
+
+EVENT_HANDLERS = {
+    "client.created": _on_client_created,
+    "client.updated": _on_client_updated,
+    "client.deactivated": _on_client_deactivated,
+    "classRosterBooking.created": _on_class_booking(+1),
+    "classRosterBooking.cancelled": _on_class_booking(-1),
+    "classRosterBookingStatus.updated": _on_class_booking_status,
+    "clientSale.created": _on_sale_created,
+}
+
+
+def handle_event(event: dict):
+    """Dispatch one webhook payload to its cache handler."""
+    event_id = event.get("eventId")
+    handler = EVENT_HANDLERS.get(event_id)
+    if handler is None:
+        return {"eventId": event_id, "status": "ignored"}
+
+    result = handler(event.get("eventData") or {})
+    return {"eventId": event_id, "status": "processed", **result}